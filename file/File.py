@@ -1,192 +1,1983 @@
 """
 File system data structures and classes
 - Block: Physical disk block
+- Disk: Memory-mapped disk image holding all blocks
 - FAT: File Allocation Table
 - FCB: File Control Block
 - CatalogNode: Directory structure node
+- Catalog: Directory tree with path resolution
 """
-from typing import List, Optional, Union
+from array import array
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Set, Tuple, Union
+import codecs
+from collections import OrderedDict, deque
+import io
+import mmap
+import os
+import pickle
+import re
+import struct
+import sys
 import time
+from types import SimpleNamespace
 
-# Constants
+from allocator import ALLOCATORS, DEFAULT_POLICY, free_runs
+from cache import BlockCache, DEFAULT_CAPACITY
+from events import ContentUpdated, EventBus, NodeCreated, NodeDeleted, NodeMoved, NodeRenamed
+from telemetry import LatencyStats, timed
+
+# Default geometry of a new volume, the geometry of a volume is chosen when
+# formatting and stored in its disk and FAT headers
 BLOCK_SIZE = 512
 BLOCK_NUM = 512
 
+# Disk image layout: header (with the geometry), per-block length table, block data
+DISK_MAGIC = b'FSDISK01'
+DISK_HEADER = struct.Struct('<8sII')
+LENGTH_ENTRY = struct.Struct('<I')
+LENGTH_TABLE_OFFSET = DISK_HEADER.size
+
+# Tables of at least this many blocks are worked on with NumPy when it is
+# installed; smaller ones are fast enough in Python and skip importing it
+VECTOR_THRESHOLD = 1 << 16
+
+# FAT file layout: header (with the allocation policy), one entry per block
+FAT_MAGIC = b'FSFAT002'
+FAT_HEADER = struct.Struct('<8sI8s')
+FAT_ENTRY = struct.Struct('<i')
+
+ENCODING = 'utf-8'
+
+# Catalog file layout: header, one fixed-size record per node in
+# breadth-first order, then the heap of UTF-8 names
+CATALOG_MAGIC = b'FSCATLG1'
+CATALOG_VERSION = 1
+CATALOG_HEADER = struct.Struct('<8sIIII')
+# id, parent id, flags, first block, first child record, child count,
+# name offset, name length, create time, update time, content update time
+INODE_RECORD = struct.Struct('<IiBiIIIHddd')
+INODE_FILE = 0x01
+# Node added or changed, as logged by the journal: id, parent id, flags,
+# first block, create time, update time, content update time, name length,
+# then the UTF-8 name
+NODE_CHANGE = struct.Struct('<IiBidddH')
+# Flag of a NODE_CHANGE whose node was appended to its directory
+NODE_APPENDED = 0x02
+
+# ID of the root directory in a Catalog
+ROOT_ID = 0
+
+# Number of resolved paths kept by a Catalog
+DENTRY_CAPACITY = 1024
+
+# Name suffix added to keep names unique within a directory
+_SUFFIX = re.compile(r'^(.*) \((\d+)\)$')
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+class _LegacyUnpickler(pickle.Unpickler):
+    """
+    Loads blocks pickled by older versions as plain attribute holders
+    """
+    def find_class(self, module, name):
+        if name == 'Block':
+            return SimpleNamespace
+        return super().find_class(module, name)
+
+
 class Block:
     """
     A physical block in the disk storage
+
+    The block content is raw bytes in a fixed-size buffer, either a slice of
+    the disk image mapping or a private buffer for a standalone block, whose
+    size is the block size. Reads hand out memoryviews of that buffer
+    instead of copies.
     """
-    def __init__(self, block_index: int, data: str = ""):
+    def __init__(self, block_index: int, data: Buffer = b"", buffer: Optional[memoryview] = None,
+                 length: int = 0, size: int = BLOCK_SIZE):
         self.block_index = block_index
-        self.data = data
+        self.buffer = buffer if buffer is not None else memoryview(bytearray(size))
+        self.length = length
+        self.dirty = False
+        if data:
+            self.write(data)
+
+    def _store(self, offset: int, data: memoryview) -> memoryview:
+        size = min(len(data), len(self.buffer) - offset)
+        self.buffer[offset:offset + size] = data[:size]
+        self.length = max(self.length, offset + size)
+        self.dirty = True
+        return data[size:]
     
-    def write(self, new_data: str) -> str:
+    def write(self, new_data: Buffer) -> memoryview:
         """
         Write data to block and return remaining data that couldn't fit
         """
-        self.data = new_data[:BLOCK_SIZE]
-        return new_data[BLOCK_SIZE:]
+        self.length = 0
+        return self._store(0, memoryview(new_data).cast('B'))
+
+    def write_at(self, offset: int, new_data: Buffer) -> memoryview:
+        """
+        Overwrite block content from offset, which must not be past the
+        current end, and return remaining data that couldn't fit
+        """
+        return self._store(offset, memoryview(new_data).cast('B'))
     
-    def read(self) -> str:
+    def read(self) -> memoryview:
         """
         Read data from block
         """
-        return self.data
+        return self.buffer[:self.length]
 
     def is_full(self) -> bool:
         """
         Check if block is full
         """
-        return len(self.data) == BLOCK_SIZE
+        return self.length == len(self.buffer)
 
-    def append(self, new_data: str) -> str:
+    def append(self, new_data: Buffer) -> memoryview:
         """
         Append new data to block and return data that couldn't fit
         """
-        remain_space = BLOCK_SIZE - len(self.data)
-        if remain_space >= len(new_data):
-            self.data += new_data
-            return ""
-        else:
-            self.data += new_data[:remain_space]
-            return new_data[remain_space:]
+        return self._store(self.length, memoryview(new_data).cast('B'))
+    
+    def truncate(self, length: int) -> None:
+        """
+        Cut block data down to length bytes
+        """
+        self.length = min(self.length, length)
+        self.dirty = True
     
     def clear(self) -> None:
         """
         Clear block data
         """
-        self.data = ""
+        self.length = 0
+        self.dirty = True
+
+
+class Disk:
+    """
+    Disk image file of block_num * block_size bytes plus a header, accessed through mmap
+
+    The image is mapped copy-on-write, so changes stay private until save()
+    writes the modified blocks back. Opening does not read the block data and
+    Block objects are only created for blocks that are actually accessed;
+    they are kept in a bounded BlockCache, which writes a dirty block's
+    length back to the mapping when it is evicted and leaves the block
+    pending until the next save.
+
+    The image is created sparse, so only blocks that were written take
+    space in the file system holding it.
+    """
+    def __init__(self, path: str, cache_capacity: int = DEFAULT_CAPACITY, cache_policy: str = 'lru'):
+        self.path = path
+        self.file = open(path, 'r+b')
+        if hasattr(mmap, 'MAP_NORESERVE'):
+            # Copy-on-write without reserving memory for the whole image up front
+            self.mapping = mmap.mmap(self.file.fileno(), 0, flags=mmap.MAP_PRIVATE | mmap.MAP_NORESERVE,
+                                     prot=mmap.PROT_READ | mmap.PROT_WRITE)
+        else:
+            self.mapping = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_COPY)
+        magic, self.block_size, self.block_num = DISK_HEADER.unpack_from(self.mapping, 0)
+        self.data_offset = LENGTH_TABLE_OFFSET + LENGTH_ENTRY.size * self.block_num
+        if (magic != DISK_MAGIC or self.block_size <= 0 or
+                len(self.mapping) < self.data_offset + self.block_size * self.block_num):
+            self.mapping.close()
+            self.file.close()
+            raise ValueError(f"{path} is not a disk image of this file system")
+        self.view = memoryview(self.mapping)
+        self.cache = BlockCache(self._load_block, self._write_back, cache_capacity, cache_policy)
+        # Blocks written back to the mapping but not yet saved to the file
+        self.pending: Set[int] = set()
+        # Blocks written back but not yet handed to the journal
+        self.unlogged: Set[int] = set()
+
+    @classmethod
+    def create(cls, path: str, block_size: int = BLOCK_SIZE, block_num: int = BLOCK_NUM) -> 'Disk':
+        """
+        Create an empty disk image of block_num blocks of block_size bytes and open it
+        """
+        if block_size <= 0 or block_num <= 0:
+            raise ValueError("block size and block count must be positive")
+        with open(path, 'wb') as f:
+            f.write(DISK_HEADER.pack(DISK_MAGIC, block_size, block_num))
+            f.truncate(LENGTH_TABLE_OFFSET + (LENGTH_ENTRY.size + block_size) * block_num)
+        return cls(path)
+
+    @classmethod
+    def open(cls, path: str) -> 'Disk':
+        """
+        Open the disk image at path, creating it if missing
+        """
+        if not os.path.exists(path):
+            return cls.create(path)
+        return cls(path)
+
+    @staticmethod
+    def is_legacy(path: str) -> bool:
+        """
+        Check whether path holds a disk saved as a pickled list of blocks by older versions
+        """
+        if not os.path.exists(path):
+            return False
+        with open(path, 'rb') as f:
+            return f.read(len(DISK_MAGIC)) != DISK_MAGIC
+
+    @classmethod
+    def convert_legacy(cls, path: str, fat: 'FAT') -> 'Disk':
+        """
+        Replace a pickled list of blocks with a disk image holding the same files
+
+        Old blocks held text and counted their size in characters, so a chain
+        may need more blocks once encoded; these are allocated from fat and appended to the
+        chain, keeping every file's start block unchanged.
+        """
+        with open(path, 'rb') as f:
+            legacy_blocks = _LegacyUnpickler(f).load()
+        legacy_data = {block.block_index: block.data for block in legacy_blocks}
+
+        successors = {entry for entry in fat.fat if entry >= 0}
+        starts = [i for i, entry in enumerate(fat.fat) if entry != -2 and i not in successors]
+
+        disk = cls.create(path)
+        for start in starts:
+            chain = [start]
+            while fat.fat[chain[-1]] != -1:
+                chain.append(fat.fat[chain[-1]])
+            data = memoryview("".join(legacy_data.get(i, "") for i in chain).encode(ENCODING))
+            for i in chain:
+                data = disk[i].write(data)
+            cur = chain[-1]
+            while data:
+                new_loc = fat.allocate()
+                if new_loc == -1:
+                    raise Exception("Disk space insufficient!")
+                fat.set_next(cur, new_loc)
+                cur = new_loc
+                data = disk[cur].write(data)
+        disk.save()
+        return disk
+
+    def __len__(self) -> int:
+        return self.block_num
+
+    def __getitem__(self, index: int) -> Block:
+        if not 0 <= index < self.block_num:
+            raise IndexError(index)
+        return self.cache.get(index)
+
+    def _load_block(self, index: int) -> Block:
+        offset = self.data_offset + index * self.block_size
+        length, = LENGTH_ENTRY.unpack_from(self.mapping, LENGTH_TABLE_OFFSET + index * LENGTH_ENTRY.size)
+        return Block(index, buffer=self.view[offset:offset + self.block_size], length=length)
+
+    def _length(self, index: int) -> int:
+        block = self.cache.blocks.get(index)
+        if block is not None:
+            return block.length
+        length, = LENGTH_ENTRY.unpack_from(self.mapping, LENGTH_TABLE_OFFSET + index * LENGTH_ENTRY.size)
+        return length
+
+    def read_run(self, start: int, count: int) -> bytes:
+        """
+        Read the content of count consecutive blocks starting at start
+
+        Blocks hold their data in the mapping, so a run whose blocks are full
+        except the last is copied with a single slice.
+        """
+        size = self.block_size
+        lengths = [self._length(index) for index in range(start, start + count)]
+        offset = self.data_offset + start * size
+        if all(length == size for length in lengths[:-1]):
+            return bytes(self.view[offset:offset + (count - 1) * size + lengths[-1]])
+        return b"".join(self.view[offset + i * size:offset + i * size + length]
+                        for i, length in enumerate(lengths))
+
+    def write_run(self, start: int, data: Buffer) -> None:
+        """
+        Fill consecutive blocks starting at start with data, every block but the last full
+        """
+        data = memoryview(data).cast('B')
+        offset = self.data_offset + start * self.block_size
+        self.view[offset:offset + len(data)] = data
+        remain = len(data)
+        index = start
+        while remain > 0:
+            length = min(remain, self.block_size)
+            self._set_length(index, length)
+            remain -= length
+            index += 1
+
+    def _set_length(self, index: int, length: int) -> None:
+        LENGTH_ENTRY.pack_into(self.mapping, LENGTH_TABLE_OFFSET + index * LENGTH_ENTRY.size, length)
+        block = self.cache.blocks.get(index)
+        if block is not None:
+            block.length = length
+        self.pending.add(index)
+        self.unlogged.add(index)
+
+    def move_block(self, src: int, dst: int) -> None:
+        """
+        Copy the content of block src to block dst and empty src
+        """
+        length = self._length(src)
+        src_offset = self.data_offset + src * self.block_size
+        dst_offset = self.data_offset + dst * self.block_size
+        self.view[dst_offset:dst_offset + length] = self.view[src_offset:src_offset + length]
+        self._set_length(dst, length)
+        self._set_length(src, 0)
+
+    def clear_run(self, start: int, count: int) -> None:
+        """
+        Empty count consecutive blocks starting at start
+        """
+        offset = LENGTH_TABLE_OFFSET + start * LENGTH_ENTRY.size
+        self.mapping[offset:offset + count * LENGTH_ENTRY.size] = bytes(count * LENGTH_ENTRY.size)
+        indices = range(start, start + count)
+        cached = self.cache.blocks
+        # Look up whichever is smaller, the run or the cache
+        if count <= len(cached):
+            blocks = [cached[index] for index in indices if index in cached]
+        else:
+            blocks = [block for index, block in cached.items() if index in indices]
+        for block in blocks:
+            block.length = 0
+            block.dirty = False
+        self.pending.update(indices)
+        self.unlogged.update(indices)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return block cache and write-back figures
+        """
+        return {
+            'block_size': self.block_size,
+            'block_num': self.block_num,
+            'cache': self.cache.stats(),
+            'pending_blocks': len(self.pending),
+        }
+
+    def _write_back(self, block: Block) -> None:
+        # The data already lives in the mapping, only the length is kept on the Block
+        LENGTH_ENTRY.pack_into(self.mapping, LENGTH_TABLE_OFFSET + block.block_index * LENGTH_ENTRY.size,
+                               block.length)
+        self.pending.add(block.block_index)
+        self.unlogged.add(block.block_index)
+        block.dirty = False
+
+    def take_changes(self) -> List[Tuple[int, bytes]]:
+        """
+        Return the blocks changed since the last call, as (index, content) pairs
+        """
+        self.cache.flush()
+        changes = []
+        for index in sorted(self.unlogged):
+            length, = LENGTH_ENTRY.unpack_from(self.mapping, LENGTH_TABLE_OFFSET + index * LENGTH_ENTRY.size)
+            offset = self.data_offset + index * self.block_size
+            changes.append((index, bytes(self.view[offset:offset + length])))
+        self.unlogged.clear()
+        return changes
+
+    def __iter__(self) -> Iterator[Block]:
+        for i in range(self.block_num):
+            yield self[i]
+
+    def save(self) -> None:
+        """
+        Write modified blocks back to the image file
+        """
+        self.cache.flush()
+        for index in sorted(self.pending):
+            length_offset = LENGTH_TABLE_OFFSET + index * LENGTH_ENTRY.size
+            self.file.seek(length_offset)
+            self.file.write(self.view[length_offset:length_offset + LENGTH_ENTRY.size])
+            data_offset = self.data_offset + index * self.block_size
+            self.file.seek(data_offset)
+            self.file.write(self.view[data_offset:data_offset + self.block_size])
+        self.pending.clear()
+        self.unlogged.clear()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self) -> None:
+        """
+        Release the mapping without saving
+        """
+        for block in self.cache:
+            block.buffer.release()
+        self.cache.clear()
+        self.view.release()
+        try:
+            self.mapping.close()
+        except BufferError:
+            # A block is still referenced elsewhere, the mapping closes once it is collected
+            pass
+        self.file.close()
 
 
 class FAT:
     """
     File Allocation Table implementation
+
+    Free space is tracked in a bitmap (1 = free) kept in sync with the
+    table. Files are written in extents: runs of consecutive blocks that
+    are filled and read with one slice of the disk image each. Where runs
+    go is decided by the allocation policy chosen when the table is
+    created (see allocator.py) and saved with it.
+
+    Entries are changed through set_next(), which records them as dirty so
+    save() only rewrites the entries changed since the last save, and as
+    unlogged until take_changes() hands them to the journal.
+
+    The table counts allocated and freed blocks and times its operations;
+    stats() reports these together with the free space and fragmentation.
+
+    Entries are kept in an array('i'). Whole-table passes (rebuilding the
+    free map, finding free runs, statistics, check()) and the search for
+    runs along a chain work on a NumPy view of it for tables of
+    VECTOR_THRESHOLD blocks or more when NumPy is installed, and loop in
+    Python otherwise.
     """
-    def __init__(self):
-        self.fat: List[int] = [-2] * BLOCK_NUM
+    def __init__(self, policy: str = DEFAULT_POLICY, block_num: int = BLOCK_NUM):
+        if policy not in ALLOCATORS:
+            raise ValueError(f"unknown allocation policy: {policy!r}")
+        self.policy = policy
+        self.block_num = block_num
+        # Entries as 32-bit ints, 4 bytes per block
+        self.fat = array('i', [-2]) * block_num
+        self.rebuild_free_map()
+        self.dirty: Set[int] = set()
+        self.unlogged: Set[int] = set()
+        # Not saved yet, the whole table has to be written
+        self.all_dirty = True
+        self.reset_stats()
+
+    def __setstate__(self, state):
+        # Loads tables pickled by older versions
+        self.__dict__.update(state)
+        self.fat = array('i', self.fat)
+        self.block_num = len(self.fat)
+        self.policy = DEFAULT_POLICY
+        self.rebuild_free_map()
+        self.dirty = set()
+        self.unlogged = set()
+        self.all_dirty = True
+        self.reset_stats()
+
+    @classmethod
+    def load(cls, path: str) -> 'FAT':
+        """
+        Load the table saved at path, or return an empty one if there is none
+        """
+        if not os.path.exists(path):
+            return cls()
+        with open(path, 'rb') as f:
+            raw = f.read()
+        if raw[:len(FAT_MAGIC)] != FAT_MAGIC:
+            return pickle.loads(raw)
+        _, block_num, policy = FAT_HEADER.unpack_from(raw, 0)
+        policy = policy.rstrip(b'\0').decode('ascii')
+        header_size = FAT_HEADER.size
+        if policy not in ALLOCATORS or len(raw) < header_size + block_num * FAT_ENTRY.size:
+            raise ValueError(f"{path} is not a FAT of this file system")
+
+        fat = cls.__new__(cls)
+        fat.policy = policy
+        fat.block_num = block_num
+        fat.fat = array('i')
+        fat.fat.frombytes(raw[header_size:header_size + block_num * FAT_ENTRY.size])
+        if sys.byteorder != 'little':
+            fat.fat.byteswap()
+        fat.rebuild_free_map()
+        fat.dirty = set()
+        fat.unlogged = set()
+        fat.all_dirty = False
+        fat.reset_stats()
+        return fat
+
+    def save(self, path: str) -> None:
+        """
+        Write the entries changed since the last save to path and sync them
+
+        A whole table replaces the file at path in one step.
+        """
+        if self.all_dirty or not os.path.exists(path):
+            entries = self.fat
+            if sys.byteorder != 'little':
+                entries = array('i', entries)
+                entries.byteswap()
+            _replace_file(path, FAT_HEADER.pack(FAT_MAGIC, self.block_num, self.policy.encode('ascii')),
+                          entries.tobytes())
+        elif self.dirty:
+            with open(path, 'r+b') as f:
+                for index in sorted(self.dirty):
+                    f.seek(FAT_HEADER.size + index * FAT_ENTRY.size)
+                    f.write(FAT_ENTRY.pack(self.fat[index]))
+                f.flush()
+                os.fsync(f.fileno())
+        self.dirty.clear()
+        self.unlogged.clear()
+        self.all_dirty = False
+
+    def take_changes(self) -> List[Tuple[int, int]]:
+        """
+        Return the entries changed since the last call, as (index, value) pairs
+        """
+        changes = [(index, self.fat[index]) for index in sorted(self.unlogged)]
+        self.unlogged.clear()
+        return changes
+
+    def set_next(self, index: int, value: int) -> None:
+        """
+        Set the entry of block index: the next block, -1 for end of chain or -2 for free
+        """
+        self.fat[index] = value
+        self.dirty.add(index)
+        self.unlogged.add(index)
+
+    def reset_stats(self) -> None:
+        """
+        Start counting allocations, frees and operation latencies from now
+        """
+        self.stats_since = time.time()
+        self.allocated_blocks = 0
+        self.freed_blocks = 0
+        self.allocation_failures = 0
+        self.latency = LatencyStats()
+
+    def _entries(self, np: Any) -> Any:
+        # NumPy view sharing memory with the table
+        return np.frombuffer(self.fat, dtype=np.int32)
+
+    def _successors(self, np: Any, start: int = 0, stop: Optional[int] = None) -> Any:
+        # The entries of blocks start..stop if every block pointed to the next one
+        if stop is None:
+            stop = self.block_num
+        return np.arange(start + 1, stop + 1, dtype=np.int32)
+
+    def free_runs(self) -> List[Tuple[int, int]]:
+        """
+        Return every run of free blocks as (start, length)
+        """
+        np = _vector(self.block_num)
+        if np is None:
+            return list(free_runs(self.free_map))
+        edges = np.diff(np.frombuffer(self.free_map, dtype=np.int8), prepend=0, append=0)
+        starts = np.flatnonzero(edges == 1)
+        lengths = np.flatnonzero(edges == -1) - starts
+        return list(zip(starts.tolist(), lengths.tolist()))
+
+    def check(self) -> Dict[str, List[int]]:
+        """
+        Validate every chain of the table and return the blocks in error
+        - invalid: Entries that are not a block index, -1 or -2
+        - cross_linked: Blocks pointed to by more than one entry
+        - free_linked: Free blocks that an entry points to
+        - looping: Used blocks whose chain runs into a cycle instead of ending
+        - free_map: Blocks whose free-map flag disagrees with the table
+        """
+        n = self.block_num
+        np = _vector(n)
+        if np is not None:
+            entries = self._entries(np)
+            used = entries != -2
+            valid = (entries >= -2) & (entries < n)
+            linked = valid & (entries >= 0)
+            counts = np.bincount(entries[linked], minlength=n)
+            # Follow every chain by pointer doubling; ends of chains, free
+            # blocks and invalid entries lead to a sink at index n
+            jump = np.append(np.where(linked, entries, n), n)
+            for _ in range(max(1, n.bit_length())):
+                jump = jump[jump]
+            free = np.frombuffer(self.free_map, dtype=np.uint8).astype(bool)
+            return {
+                'invalid': np.flatnonzero(~valid).tolist(),
+                'cross_linked': np.flatnonzero(counts > 1).tolist(),
+                'free_linked': np.flatnonzero((counts > 0) & ~used).tolist(),
+                'looping': np.flatnonzero(used & valid & (jump[:n] != n)).tolist(),
+                'free_map': np.flatnonzero(free == used).tolist(),
+            }
+
+        invalid = []
+        counts = [0] * n
+        for index, entry in enumerate(self.fat):
+            if not -2 <= entry < n:
+                invalid.append(index)
+            elif entry >= 0:
+                counts[entry] += 1
+        # 1: the chain from the block ends, 2: it runs into a cycle, 3: on the path being followed
+        state = bytearray(n)
+        for index in range(n):
+            if state[index] or self.fat[index] == -2:
+                continue
+            path = []
+            current = index
+            while 0 <= current < n and not state[current] and self.fat[current] != -2:
+                state[current] = 3
+                path.append(current)
+                current = self.fat[current]
+            result = 2 if 0 <= current < n and state[current] in (2, 3) else 1
+            for i in path:
+                state[i] = result
+        return {
+            'invalid': invalid,
+            'cross_linked': [i for i in range(n) if counts[i] > 1],
+            'free_linked': [i for i in range(n) if counts[i] and self.fat[i] == -2],
+            'looping': [i for i in range(n) if state[i] == 2 and -2 <= self.fat[i] < n],
+            'free_map': [i for i in range(n) if self.free_map[i] != (self.fat[i] == -2)],
+        }
+
+    def free_space(self, runs: Optional[Sequence[int]] = None) -> Dict[str, Any]:
+        """
+        Return how much space is free and how it is split into runs, given
+        the lengths of the free runs if they are already known
+        """
+        if runs is None:
+            runs = [length for _, length in self.free_runs()]
+        largest = max(runs, default=0)
+        return {
+            'free_blocks': self.free_count,
+            'free_runs': len(runs),
+            'largest_free_run': largest,
+            # Share of free space outside the largest run
+            'external_fragmentation': 1 - largest / self.free_count if self.free_count else 0.0,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return space, fragmentation and activity figures
+
+        Chains are counted from the table alone: every used block that no
+        entry points to starts a file, and every link to a block other than
+        the next one starts a new fragment.
+        """
+        used = self.block_num - self.free_count
+        np = _vector(self.block_num)
+        if np is not None:
+            entries = self._entries(np)
+            linked = entries >= 0
+            links = int(np.count_nonzero(linked))
+            jumps = int(np.count_nonzero(linked & (entries != self._successors(np))))
+        else:
+            links = 0
+            jumps = 0
+            for index, entry in enumerate(self.fat):
+                if entry >= 0:
+                    links += 1
+                    if entry != index + 1:
+                        jumps += 1
+        files = used - links
+        elapsed = max(time.time() - self.stats_since, 1e-9)
+        stats = {
+            'policy': self.policy,
+            'total_blocks': self.block_num,
+            'used_blocks': used,
+        }
+        stats.update(self.free_space())
+        stats.update({
+            'files': files,
+            'avg_fragments_per_file': (files + jumps) / files if files else 0.0,
+            'seconds': elapsed,
+            'allocated_blocks': self.allocated_blocks,
+            'freed_blocks': self.freed_blocks,
+            'allocation_failures': self.allocation_failures,
+            'allocation_rate': self.allocated_blocks / elapsed,
+            'free_rate': self.freed_blocks / elapsed,
+            'latency': self.latency.stats(),
+        })
+        return stats
+
+    def rebuild_free_map(self) -> None:
+        """
+        Rebuild the free-space bitmap from the table
+        """
+        np = _vector(self.block_num)
+        if np is not None:
+            self.free_map = bytearray((self._entries(np) == -2).tobytes())
+        else:
+            self.free_map = bytearray(map((-2).__eq__, self.fat))
+        self.free_count = self.free_map.count(1)
+        self.allocator = ALLOCATORS[self.policy](self.free_map)
 
     def find_blank(self) -> int:
         """
-        Find first available block
+        Find an available block as chosen by the allocation policy
+        """
+        if self.free_count == 0:
+            return -1
+        return self.allocator.find_run(1)[0]
+
+    def allocate(self) -> int:
         """
-        for i in range(BLOCK_NUM):
-            if self.fat[i] == -2:
-                return i
-        return -1
+        Reserve an available block and return its index, or -1 if the disk is full
+        """
+        return self.allocate_run(1)[0]
+
+    def allocate_run(self, count: int) -> Tuple[int, int]:
+        """
+        Reserve up to count consecutive blocks chained in order
+        Returns (start, length), or (-1, 0) if the disk is full
+        """
+        if self.free_count == 0:
+            return -1, 0
+        start, length = self.allocator.find_run(count)
+        end = start + length
+        self.free_map[start:end] = bytes(length)
+        self.free_count -= length
+        self.allocator.reserve(start, length)
+        self.allocated_blocks += length
+        for index in range(start, end - 1):
+            self.set_next(index, index + 1)
+        self.set_next(end - 1, -1)
+        return start, length
+
+    def allocate_extents(self, count: int) -> List[Tuple[int, int]]:
+        """
+        Reserve count blocks as one chain made of as few runs as possible
+        Returns the runs as (start, length) extents
+        """
+        if count > self.free_count:
+            self.allocation_failures += 1
+            raise Exception("Disk space insufficient!")
+        extents = []
+        while count > 0:
+            start, length = self.allocate_run(count)
+            if extents:
+                last_start, last_length = extents[-1]
+                self.set_next(last_start + last_length - 1, start)
+            extents.append((start, length))
+            count -= length
+        return extents
+
+    def extents(self, start: int) -> List[Tuple[int, int]]:
+        """
+        Return the chain starting at start as (start, length) runs of consecutive blocks
+        """
+        extents = []
+        while start >= 0:
+            length = self._run_length(start)
+            extents.append((start, length))
+            start = self.fat[start + length - 1]
+        return extents
+
+    def _run_length(self, start: int) -> int:
+        # Number of blocks from start on that each point to the next one, plus one
+        fat = self.fat
+        end = start
+        # Short runs are cheaper to follow one entry at a time
+        limit = min(start + 16, self.block_num)
+        while end < limit and fat[end] == end + 1:
+            end += 1
+        np = _vector(self.block_num)
+        if end < limit or np is None:
+            while fat[end] == end + 1:
+                end += 1
+            return end - start + 1
+        entries = self._entries(np)
+        step = 64
+        while True:
+            stop = min(end + step, self.block_num)
+            breaks = np.flatnonzero(entries[end:stop] != self._successors(np, end, stop))
+            if breaks.size:
+                return end + int(breaks[0]) - start + 1
+            end = stop
+            step *= 2
+
+    def release_run(self, start: int, length: int) -> None:
+        """
+        Return length consecutive used blocks to the free space
+        """
+        end = start + length
+        self.fat[start:end] = array('i', [-2]) * length
+        self.free_map[start:end] = b'\x01' * length
+        self.free_count += length
+        self.freed_blocks += length
+        indices = range(start, end)
+        self.dirty.update(indices)
+        self.unlogged.update(indices)
+        self.allocator.release_run(start, length)
+
+    def release(self, index: int) -> None:
+        """
+        Return a block to the free space
+        """
+        if self.fat[index] != -2:
+            self.set_next(index, -2)
+            self.free_map[index] = 1
+            self.free_count += 1
+            self.freed_blocks += 1
+            self.allocator.release(index)
     
-    def write(self, data: str, disk: List[Block]) -> int:
+    def relocate(self, src: int, dst: int, prev: int, disk: 'Disk') -> None:
+        """
+        Move block src of a chain to the free block dst
+        prev is the block before src in the chain, or -1 if the chain starts at src
+        """
+        if not self.free_map[dst]:
+            raise ValueError(f"block {dst} is in use")
+        self.free_map[dst] = 0
+        self.free_count -= 1
+        self.allocated_blocks += 1
+        self.allocator.reserve(dst, 1)
+        self.set_next(dst, self.fat[src])
+        if prev != -1:
+            self.set_next(prev, dst)
+        disk.move_block(src, dst)
+        self.release(src)
+
+    @timed('write')
+    def write(self, data: Buffer, disk: 'Disk') -> int:
         """
         Write data to disk, allocating blocks as needed
         Returns the starting block index
         """
-        start = -1
-        cur = -1
+        return self._write(memoryview(data).cast('B'), disk)
 
-        while data:
-            new_loc = self.find_blank()
-            if new_loc == -1:
-                raise Exception("Disk space insufficient!")
-            
-            if cur != -1:
-                self.fat[cur] = new_loc
-            else:
-                start = new_loc
-                
-            cur = new_loc
-            data = disk[cur].write(data)
-            self.fat[cur] = -1
-
-        return start
+    def _write(self, data: memoryview, disk: 'Disk') -> int:
+        # write() without the timing, for operations timed as a whole
+        if not data:
+            return -1
+        size = disk.block_size
+        extents = self.allocate_extents(-(-len(data) // size))
+        offset = 0
+        for start, length in extents:
+            disk.write_run(start, data[offset:offset + length * size])
+            offset += length * size
+        return extents[0][0]
     
-    def delete(self, start: int, disk: List[Block]) -> None:
+    @timed('delete')
+    def delete(self, start: int, disk: 'Disk') -> None:
         """
         Delete file chain starting at given block
         """
-        if start == -1:
-            return
+        self._delete(start, disk)
 
-        while self.fat[start] != -1:
-            disk[start].clear()
-            next_block = self.fat[start]
-            self.fat[start] = -2
-            start = next_block
-
-        self.fat[start] = -2
-        disk[start].clear()
+    def _delete(self, start: int, disk: 'Disk') -> None:
+        # delete() without the timing, for operations timed as a whole
+        for run_start, length in self.extents(start):
+            disk.clear_run(run_start, length)
+            self.release_run(run_start, length)
     
-    def update(self, start: int, data: str, disk: List[Block]) -> int:
+    @timed('update')
+    def update(self, start: int, data: Buffer, disk: 'Disk') -> int:
         """
-        Update file data by deleting old chain and writing new data
+        Replace the content of the chain starting at start with data
+        Returns the (possibly new) starting block index
+
+        Blocks are compared with the new content one by one and only the
+        ones that differ are rewritten; blocks are allocated or freed only
+        at the tail of the chain.
         """
-        self.delete(start, disk)
-        return self.write(data, disk)
+        data = memoryview(data).cast('B')
+        if start == -1:
+            return self._write(data, disk)
+        if not data:
+            self._delete(start, disk)
+            return -1
+
+        size = disk.block_size
+        extra = -(-len(data) // size) - sum(1 for _ in self.iter_chain(start))
+        if extra > self.free_count:
+            self.allocation_failures += 1
+            raise Exception("Disk space insufficient!")
+
+        prev = -1
+        cur = start
+        while data and cur != -1:
+            block = disk[cur]
+            chunk = data[:size]
+            if block.read() != chunk:
+                block.write(chunk)
+            data = data[len(chunk):]
+            prev = cur
+            cur = self.fat[cur]
 
-    def read(self, start: int, disk: List[Block]) -> str:
+        if data:
+            # New content is longer, extend the tail
+            self.set_next(prev, self._write(data, disk))
+        elif cur != -1:
+            # New content is shorter, cut the chain and free the rest
+            self.set_next(prev, -1)
+            self._delete(cur, disk)
+        return start
+
+    def iter_chain(self, start: int) -> Iterator[int]:
         """
-        Read file data from block chain
+        Yield the block indices of the chain starting at start
         """
-        if start == -1:
-            return ""
-            
-        data = ""
         current = start
-        
-        while True:
-            data += disk[current].read()
-            if self.fat[current] == -1:
-                break
+        while current != -1:
+            yield current
             current = self.fat[current]
-            
-        return data
+
+    def iter_blocks(self, start: int, disk: Sequence[Block]) -> Iterator[memoryview]:
+        """
+        Yield the content of each block in the chain starting at start
+
+        The views share memory with the blocks, so they must be consumed
+        before the file is modified.
+        """
+        for index in self.iter_chain(start):
+            yield disk[index].read()
+
+    @timed('read')
+    def read(self, start: int, disk: 'Disk') -> bytes:
+        """
+        Read file data from block chain
+        """
+        return self.read_extents(self.extents(start), disk)
+
+    @staticmethod
+    def read_extents(extents: Sequence[Tuple[int, int]], disk: 'Disk') -> bytes:
+        """
+        Read the data held by a list of extents
+        """
+        if len(extents) == 1:
+            return disk.read_run(*extents[0])
+        return b"".join(disk.read_run(start, length) for start, length in extents)
+
+
+_numpy: Any = False
+
+
+def _vector(block_num: int) -> Any:
+    """
+    Return the NumPy module to work on a table of block_num entries, or
+    None to loop in Python
+    """
+    global _numpy
+    if block_num < VECTOR_THRESHOLD:
+        return None
+    if _numpy is False:
+        try:
+            import numpy
+            _numpy = numpy
+        except ImportError:
+            _numpy = None
+    return _numpy
+
+
+def _encode(data: Union[str, Buffer]) -> Buffer:
+    """
+    Encode text content, leaving binary content unchanged
+    """
+    return data.encode(ENCODING) if isinstance(data, str) else data
+
+
+def _replace_file(path: str, *chunks: Buffer) -> None:
+    """
+    Write chunks to a file next to path, sync it and move it over path, so a
+    crash leaves either the old or the new content at path
+    """
+    temp = path + '.tmp'
+    with open(temp, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+    if os.name == 'posix':
+        # Make the rename itself durable
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
 
 
 class FCB:
     """
     File Control Block for managing file metadata
+
+    File content is stored as bytes; text passed in or read out through
+    this class is encoded with ENCODING. The extents of the content are
+    kept next to the start of its FAT chain and worked out from the chain
+    again after it changes.
     """
-    def __init__(self, name: str, create_time: time.struct_time, data: str, fat: FAT, disk: List[Block]):
+    # (start, length) runs of the chain, None until known
+    extents: Optional[List[Tuple[int, int]]] = None
+    # Catalog node holding the file, told when the metadata changes
+    node: Optional['CatalogNode'] = None
+
+    def __init__(self, name: str, create_time: time.struct_time, data: Union[str, Buffer],
+                 fat: FAT, disk: Sequence[Block]):
         self.name = name
         self.create_time = create_time
         self.update_time = self.create_time
-        self.start = fat.write(data, disk) if data else -1
+        self.start = fat.write(_encode(data), disk) if data else -1
+        self.extents = fat.extents(self.start)
     
-    def update(self, new_data: str, fat: FAT, disk: List[Block]) -> None:
+    def update(self, new_data: Union[str, Buffer], fat: FAT, disk: Sequence[Block]) -> None:
         """
         Update file content
         """
-        self.start = fat.update(self.start, new_data, disk)
+        self.start = fat.update(self.start, _encode(new_data), disk)
+        self.extents = fat.extents(self.start)
         self.update_time = time.localtime()
+        self.touch()
+
+    def touch(self) -> None:
+        """
+        Record that the metadata changed since the last save
+        """
+        if self.node is not None:
+            self.node.touch()
     
-    def delete(self, fat: FAT, disk: List[Block]) -> None:
+    def delete(self, fat: FAT, disk: Sequence[Block]) -> None:
         """
         Delete file from disk
         """
         fat.delete(self.start, disk)
+        self.extents = None
     
-    def read(self, fat: FAT, disk: List[Block]) -> str:
+    def read(self, fat: FAT, disk: Sequence[Block]) -> str:
+        """
+        Read file content as text
+        """
+        return self.read_bytes(fat, disk).decode(ENCODING, errors='replace')
+
+    def read_bytes(self, fat: FAT, disk: Sequence[Block]) -> bytes:
         """
-        Read file content
+        Read raw file content
         """
         if self.start == -1:
-            return ""
-        return fat.read(self.start, disk)
+            return b""
+        return fat.read_extents(self.get_extents(fat), disk)
+
+    def size(self, fat: FAT, disk: 'Disk') -> int:
+        """
+        Return the content size in bytes, every block but the last being full
+        """
+        if self.start == -1:
+            return 0
+        extents = self.get_extents(fat)
+        last_start, last_length = extents[-1]
+        blocks = sum(length for _, length in extents)
+        return (blocks - 1) * disk.block_size + disk[last_start + last_length - 1].length
+
+    def get_extents(self, fat: FAT) -> List[Tuple[int, int]]:
+        """
+        Return the (start, length) runs holding the content
+        """
+        if self.extents is None:
+            self.extents = fat.extents(self.start)
+        return self.extents
+
+    def open(self, fat: FAT, disk: Sequence[Block], mode: str = 'r') -> 'FileHandle':
+        """
+        Open the file for seekable reading and writing
+        """
+        return FileHandle(self, fat, disk, mode)
+
+    def stream(self, fat: FAT, disk: Sequence[Block],
+               encoding: Optional[str] = None) -> Iterator[Union[memoryview, str]]:
+        """
+        Yield file content block by block without reading the whole file
+
+        Raw memoryviews are yielded by default; with an encoding, text is
+        decoded incrementally so characters split across blocks stay whole.
+        """
+        if encoding is None:
+            yield from fat.iter_blocks(self.start, disk)
+            return
+        decoder = codecs.getincrementaldecoder(encoding)(errors='replace')
+        for chunk in fat.iter_blocks(self.start, disk):
+            text = decoder.decode(chunk)
+            if text:
+                yield text
+        text = decoder.decode(b"", final=True)
+        if text:
+            yield text
+
+
+class FileHandle:
+    """
+    Seekable handle on a file's content
+
+    Modes follow open(): 'r' reads, 'w' truncates and writes, 'a' writes
+    at the end, and '+' adds the missing direction. Every block of a chain
+    except the last is full, so the block holding an offset is found by
+    walking the chain; the handle remembers the block it last used, which
+    keeps sequential access at constant cost per block.
+    """
+    def __init__(self, fcb: FCB, fat: FAT, disk: Sequence[Block], mode: str = 'r'):
+        if mode not in ('r', 'w', 'a', 'r+', 'w+', 'a+'):
+            raise ValueError(f"invalid mode: {mode!r}")
+        self.fcb = fcb
+        self.fat = fat
+        self.disk = disk
+        self.mode = mode
+        self.readable = mode[0] == 'r' or '+' in mode
+        self.writable = mode != 'r'
+        self.appending = mode[0] == 'a'
+        self.closed = False
+
+        # Cached chain position: current block and the file offset it starts at
+        self._block = fcb.start
+        self._offset = 0
+
+        self.size = 0
+        self._tail = -1
+        if fcb.start != -1:
+            extents = fcb.get_extents(fat)
+            last_start, last_length = extents[-1]
+            self._tail = last_start + last_length - 1
+            blocks = sum(length for _, length in extents)
+            self.size = (blocks - 1) * disk.block_size + disk[self._tail].length
+
+        if mode[0] == 'w':
+            self.truncate(0)
+        self.position = self.size if self.appending else 0
+
+    def __enter__(self) -> 'FileHandle':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.closed = True
+
+    def _check(self, writing: bool) -> None:
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        if writing and not self.writable:
+            raise io.UnsupportedOperation("File not open for writing")
+        if not writing and not self.readable:
+            raise io.UnsupportedOperation("File not open for reading")
+
+    def _locate(self, pos: int) -> Block:
+        """
+        Move the cached chain position to the block holding byte pos
+        """
+        if pos < self._offset or self._block == -1:
+            self._block = self.fcb.start
+            self._offset = 0
+        size = self.disk.block_size
+        while pos >= self._offset + size:
+            self._block = self.fat.fat[self._block]
+            self._offset += size
+        return self.disk[self._block]
+
+    def _reserve(self, new_size: int) -> None:
+        """
+        Fail before writing anything if growing to new_size needs more blocks than are free
+        """
+        size = self.disk.block_size
+        extra = -(-new_size // size) - -(-self.size // size)
+        if extra > self.fat.free_count:
+            raise Exception("Disk space insufficient!")
+
+    def _extend(self, data: memoryview) -> None:
+        """
+        Append data at the end of the file
+        """
+        self.size += len(data)
+        if self._tail != -1:
+            data = self.disk[self._tail].append(data)
+        if not data:
+            return
+        start = self.fat.write(data, self.disk)
+        self.fcb.extents = None
+        if self._tail == -1:
+            self.fcb.start = start
+        else:
+            self.fat.set_next(self._tail, start)
+        for index in self.fat.iter_chain(start):
+            self._tail = index
+
+    def read(self, n: int = -1) -> bytes:
+        """
+        Read up to n bytes from the current position, or to the end if n is negative
+        """
+        self._check(False)
+        remain = self.size - self.position
+        if n is not None and 0 <= n < remain:
+            remain = n
+        parts = []
+        while remain > 0:
+            block = self._locate(self.position)
+            offset = self.position - self._offset
+            view = block.read()[offset:offset + remain]
+            parts.append(view)
+            self.position += len(view)
+            remain -= len(view)
+        return b"".join(parts)
+
+    def write(self, buf: Buffer) -> int:
+        """
+        Write buf at the current position, or at the end in append mode
+        Returns the number of bytes written
+        """
+        self._check(True)
+        data = memoryview(buf).cast('B')
+        written = len(data)
+        if self.appending:
+            self.position = self.size
+        self._reserve(max(self.size, self.position + written))
+
+        if self.position > self.size:
+            # Fill the gap left by seeking past the end with zeros
+            self._extend(memoryview(bytes(self.position - self.size)))
+
+        # Overwrite existing content in place
+        while data and self.position < self.size:
+            block = self._locate(self.position)
+            rest = block.write_at(self.position - self._offset, data)
+            self.position += len(data) - len(rest)
+            data = rest
+        self.size = max(self.size, self.position)
+
+        if data:
+            self._extend(data)
+            self.position += len(data)
+        if written:
+            self.fcb.update_time = time.localtime()
+            self.fcb.touch()
+        return written
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        """
+        Move the current position and return it
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        elif whence != io.SEEK_SET:
+            raise ValueError(f"invalid whence: {whence}")
+        if offset < 0:
+            raise ValueError(f"negative seek position {offset}")
+        self.position = offset
+        return offset
+
+    def tell(self) -> int:
+        """
+        Return the current position
+        """
+        return self.position
+
+    def truncate(self, size: Optional[int] = None) -> int:
+        """
+        Resize the file to size bytes, the current position by default
+        """
+        self._check(True)
+        if size is None:
+            size = self.position
+        if size < 0:
+            raise ValueError(f"negative size value {size}")
+
+        if size > self.size:
+            self._reserve(size)
+            self._extend(memoryview(bytes(size - self.size)))
+        elif size < self.size:
+            self.fcb.extents = None
+            if size == 0:
+                self.fat.delete(self.fcb.start, self.disk)
+                self.fcb.start = -1
+                self._tail = -1
+            else:
+                block = self._locate(size - 1)
+                block.truncate(size - self._offset)
+                rest = self.fat.fat[block.block_index]
+                self.fat.set_next(block.block_index, -1)
+                self.fat.delete(rest, self.disk)
+                self._tail = block.block_index
+            self.size = size
+            self._block = self.fcb.start
+            self._offset = 0
+        else:
+            return size
+        self.fcb.update_time = time.localtime()
+        self.fcb.touch()
+        return size
 
 
 class CatalogNode:
     """
     Directory tree node for multi-level directory structure
+
+    Nodes live in the inode table of a Catalog and refer to their parent and
+    children by ID. Directories keep their child IDs in creation order
+    together with a name -> ID index, so lookups and name collision checks
+    do not scan the children.
     """
-    def __init__(self, name: str, is_file: bool, fat: FAT, disk: List[Block], 
+    # Built on first use
+    _index: Optional[Dict[str, int]] = None
+    _name_counters: Optional[Dict[str, int]] = None
+
+    def __init__(self, name: str, is_file: bool, fat: FAT, disk: Sequence[Block], 
                  create_time: time.struct_time, parent: Optional['CatalogNode'] = None, 
-                 data: str = ""):
+                 data: Union[str, Buffer] = ""):
+        self.id = -1
+        self.parent_id = parent.id if parent is not None else -1
+        self.catalog: Optional['Catalog'] = None
         self.name = name
         self.is_file = is_file
-        self.parent = parent
         self.create_time = create_time
         self.update_time = self.create_time
         
         if not self.is_file:
-            self.children: List['CatalogNode'] = []
+            # Ordered set of child IDs
+            self.child_ids: Dict[int, None] = {}
         else:
             self.data = FCB(name, create_time, data, fat, disk)
-        
\ No newline at end of file
+            self.data.node = self
+
+    def __getattr__(self, name):
+        # Children of a directory not yet read from the catalog file
+        state = self.__dict__
+        if name == 'child_ids' and '_record' in state and state.get('catalog') is not None:
+            return self.catalog.load_children(self)
+        raise AttributeError(name)
+
+    @property
+    def is_loaded(self) -> bool:
+        """
+        Whether the children of this directory are in memory
+        """
+        return 'child_ids' in self.__dict__
+
+    def load(self) -> None:
+        """
+        Read the children of this directory if they are not in memory
+        """
+        if not self.is_loaded:
+            self.catalog.load_children(self)
+
+    @property
+    def parent(self) -> Optional['CatalogNode']:
+        return self.catalog.nodes.get(self.parent_id) if self.catalog is not None else None
+
+    @property
+    def children(self) -> List['CatalogNode']:
+        nodes = self.catalog.nodes
+        return [nodes[child_id] for child_id in self.child_ids]
+
+    @property
+    def child_count(self) -> int:
+        if 'child_ids' in self.__dict__:
+            return len(self.child_ids)
+        return self.catalog.stored_child_count(self)
+
+    def _names(self) -> Dict[str, int]:
+        if self._index is None:
+            self._index = {child.name: child.id for child in self.children}
+            self._name_counters = {}
+        return self._index
+
+    def touch(self) -> None:
+        """
+        Record in the catalog that the node changed since the last save
+        """
+        if self.catalog is not None:
+            self.catalog.changed.setdefault(self.id, False)
+
+    def get_child(self, name: str) -> Optional['CatalogNode']:
+        """
+        Return the child with the given name, or None
+        """
+        child_id = self._names().get(name)
+        return self.catalog.nodes[child_id] if child_id is not None else None
+
+    def unique_name(self, base: str, exclude: Optional['CatalogNode'] = None) -> str:
+        """
+        Return base, or base with the smallest free " (n)" suffix if a child
+        other than exclude already has that name
+        """
+        names = self._names()
+        if base not in names or (exclude is not None and names[base] == exclude.id):
+            return base
+        # Every suffix below the counter is known to be taken
+        count = self._name_counters.get(base, 1)
+        while f"{base} ({count})" in names:
+            count += 1
+        self._name_counters[base] = count
+        return f"{base} ({count})"
+
+    def _forget_name(self, name: str) -> None:
+        del self._names()[name]
+        # A freed " (n)" suffix becomes the smallest candidate again
+        match = _SUFFIX.match(name)
+        if match:
+            base, count = match.group(1), int(match.group(2))
+            if count < self._name_counters.get(base, 1):
+                self._name_counters[base] = count
+
+    def add_child(self, node: 'CatalogNode') -> None:
+        """
+        Add a node of the same catalog to this directory
+        """
+        node.parent_id = self.id
+        self.child_ids[node.id] = None
+        self._names()[node.name] = node.id
+
+    def remove_child(self, node: 'CatalogNode') -> None:
+        """
+        Remove a node from this directory
+        """
+        self._forget_name(node.name)
+        del self.child_ids[node.id]
+
+    def rename(self, name: str) -> None:
+        """
+        Change the node name
+        """
+        parent = self.parent
+        if parent is not None:
+            parent._forget_name(self.name)
+            parent._names()[name] = self.id
+        self.name = name
+        if self.is_file:
+            self.data.name = name
+        self.touch()
+
+
+class DentryCache:
+    """
+    Bounded LRU cache of resolved paths, keyed by the tuple of names below the root
+    """
+    def __init__(self, capacity: int = DENTRY_CAPACITY):
+        self.capacity = capacity
+        self.entries: 'OrderedDict[Tuple[str, ...], CatalogNode]' = OrderedDict()
+
+    def get(self, key: Tuple[str, ...]) -> Optional[CatalogNode]:
+        node = self.entries.get(key)
+        if node is not None:
+            self.entries.move_to_end(key)
+        return node
+
+    def put(self, key: Tuple[str, ...], node: CatalogNode) -> None:
+        self.entries[key] = node
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, key: Tuple[str, ...]) -> None:
+        """
+        Drop the entry for key and every entry below it
+        """
+        depth = len(key)
+        stale = [cached for cached in self.entries if cached[:depth] == key]
+        for cached in stale:
+            del self.entries[cached]
+
+
+class Catalog:
+    """
+    Directory tree of the file system
+
+    Nodes are kept in an inode table keyed by stable integer IDs, the root
+    having ROOT_ID, so adding or removing a node does not touch the rest
+    of the tree. Paths are resolved through a bounded dentry cache;
+    changes must go through the catalog so cached paths are invalidated
+    and the matching event is published on self.events.
+
+    A catalog read from its file starts with only the root; the children
+    of a directory are read from the file when first accessed, so startup
+    and memory grow with what is browsed rather than with the volume.
+    Iterating or counting the catalog covers the nodes loaded so far.
+
+    The IDs of nodes added or changed and of nodes removed since the last
+    save are recorded as the changes happen, so saving costs what changed.
+    Changed IDs are kept in the order the nodes were last put in a
+    directory, which is the order they were appended to its children, and
+    map to whether the node was appended since the last save.
+    """
+    # Records and name heap of the loaded catalog file
+    _records: Optional[memoryview] = None
+    _heap = b""
+    _times: Optional[Dict[float, time.struct_time]] = None
+    # Record number of each node ID in the loaded catalog file, built on first use
+    _record_of: Optional[Dict[int, int]] = None
+
+    def __init__(self, root: CatalogNode):
+        self.nodes: Dict[int, CatalogNode] = {}
+        self.next_id = ROOT_ID
+        self.dentries = DentryCache()
+        self.events = EventBus()
+        self.all_dirty = False
+        self.changed: Dict[int, bool] = {}
+        self.removed: Set[int] = set()
+        self._register(root)
+        root.parent_id = -1
+
+    @classmethod
+    def from_tree(cls, root: CatalogNode) -> 'Catalog':
+        """
+        Build a catalog from nodes pickled by older versions, which linked
+        to their parent and children directly and may use old attribute names
+        """
+        catalog = cls.__new__(cls)
+        catalog.nodes = {}
+        catalog.next_id = ROOT_ID
+        catalog.dentries = DentryCache()
+        catalog.events = EventBus()
+        # Not yet stored in the current format
+        catalog.all_dirty = True
+        catalog.changed = {}
+        catalog.removed = set()
+
+        queue = deque([root])
+        catalog._register(root)
+        root.parent_id = -1
+        while queue:
+            node = queue.popleft()
+            state = node.__dict__
+            # Attribute names used by older versions
+            for old, new in (('isFile', 'is_file'), ('createTime', 'create_time'),
+                             ('updateTime', 'update_time')):
+                if old in state:
+                    state[new] = state.pop(old)
+            state.pop('parent', None)
+            children = state.pop('children', None)
+            if node.is_file:
+                node.data.node = node
+                continue
+            node.child_ids = {}
+            for child in children:
+                catalog._register(child)
+                child.parent_id = node.id
+                node.child_ids[child.id] = None
+                queue.append(child)
+        return catalog
+
+    @classmethod
+    def load(cls, path: str) -> 'Catalog':
+        """
+        Load the catalog saved at path
+        """
+        with open(path, 'rb') as f:
+            return cls.from_bytes(f.read())
+
+    def save(self, path: str) -> None:
+        """
+        Write the whole catalog to path and mark its nodes as saved
+
+        The file at path is replaced in one step once the new one is synced.
+        """
+        _replace_file(path, self.to_bytes())
+        self.changed.clear()
+        self.removed.clear()
+        self.all_dirty = False
+
+    @classmethod
+    def from_bytes(cls, raw: Buffer) -> 'Catalog':
+        """
+        Decode a catalog written by to_bytes, or pickled by an older version
+        """
+        if raw[:len(CATALOG_MAGIC)] != CATALOG_MAGIC:
+            # Older versions pickled a flat list of linked nodes
+            return cls.from_tree(pickle.loads(raw)[0])
+        _, version, count, next_id, heap_size = CATALOG_HEADER.unpack_from(raw, 0)
+        if version != CATALOG_VERSION:
+            raise ValueError(f"unsupported catalog version {version}")
+
+        heap_offset = CATALOG_HEADER.size + count * INODE_RECORD.size
+        catalog = cls.__new__(cls)
+        catalog.nodes = {}
+        catalog.next_id = next_id
+        catalog.dentries = DentryCache()
+        catalog.events = EventBus()
+        catalog.all_dirty = False
+        catalog.changed = {}
+        catalog.removed = set()
+        # Records stay in memory and are decoded when first needed
+        catalog._records = memoryview(bytes(raw[CATALOG_HEADER.size:heap_offset]))
+        catalog._heap = bytes(raw[heap_offset:heap_offset + heap_size])
+        catalog._times = {}
+        catalog._stored_node(0)
+        return catalog
+
+    def _localtime(self, seconds: float) -> time.struct_time:
+        # Many nodes share timestamps, convert each one once
+        if self._times is None:
+            self._times = {}
+        value = self._times.get(seconds)
+        if value is None:
+            value = self._times[seconds] = time.localtime(seconds)
+        return value
+
+    def _stored_node(self, record: int) -> CatalogNode:
+        """
+        Create the node for a record of the loaded catalog file, leaving the
+        children of a directory to be read on first access
+        """
+        (node_id, parent_id, flags, start, _, _, name_offset, name_length,
+         create_time, update_time, content_time) = INODE_RECORD.unpack_from(
+            self._records, record * INODE_RECORD.size)
+        name = self._heap[name_offset:name_offset + name_length].decode(ENCODING)
+        node = self._new_node(node_id, parent_id, flags, start, name,
+                              create_time, update_time, content_time)
+        if not node.is_file:
+            node._record = record
+        self.nodes[node_id] = node
+        return node
+
+    def _new_node(self, node_id: int, parent_id: int, flags: int, start: int, name: str,
+                  create_time: float, update_time: float, content_time: float) -> CatalogNode:
+        node = CatalogNode.__new__(CatalogNode)
+        node.id = node_id
+        node.parent_id = parent_id
+        node.catalog = self
+        node.name = name
+        node.is_file = bool(flags & INODE_FILE)
+        node.create_time = self._localtime(create_time)
+        node.update_time = self._localtime(update_time)
+        if node.is_file:
+            fcb = node.data = FCB.__new__(FCB)
+            fcb.name = name
+            fcb.create_time = node.create_time
+            fcb.update_time = self._localtime(content_time)
+            fcb.start = start
+            fcb.node = node
+        return node
+
+    def find(self, node_id: int) -> Optional[CatalogNode]:
+        """
+        Return the node with the given ID, reading the directories above it
+        from the catalog file if needed, or None if there is none
+        """
+        node = self.nodes.get(node_id)
+        if node is not None or self._records is None:
+            return node
+        if self._record_of is None:
+            self._record_of = {fields[0]: record for record, fields
+                               in enumerate(INODE_RECORD.iter_unpack(self._records))}
+        record = self._record_of.get(node_id)
+        if record is None:
+            return None
+        # Load the stored parent, unless the node left it or was removed since
+        parent_id = INODE_RECORD.unpack_from(self._records, record * INODE_RECORD.size)[1]
+        parent = self.find(parent_id) if parent_id != -1 else None
+        if parent is None or parent.is_file or parent.is_loaded:
+            return None
+        parent.load()
+        node = self.nodes.get(node_id)
+        return node if node is not None and node.parent_id == parent_id else None
+
+    def _stored_children(self, record: int) -> range:
+        """
+        Return the record numbers of the children of a stored directory
+        """
+        first, count = INODE_RECORD.unpack_from(self._records, record * INODE_RECORD.size)[4:6]
+        return range(first, first + count)
+
+    def load_children(self, node: CatalogNode) -> Dict[int, None]:
+        """
+        Read the children of a directory that has not been loaded yet
+        """
+        node.child_ids = {self._stored_node(record).id: None
+                          for record in self._stored_children(node._record)}
+        return node.child_ids
+
+    def stored_child_count(self, node: CatalogNode) -> int:
+        return len(self._stored_children(node._record))
+
+    def to_bytes(self) -> bytes:
+        """
+        Encode the catalog in the current format
+
+        Directories that were never loaded are copied from the records of
+        the loaded file without creating their nodes.
+        """
+        records = []
+        heap = bytearray()
+        times: Dict[time.struct_time, float] = {}
+
+        def mktime(value: time.struct_time) -> float:
+            seconds = times.get(value)
+            if seconds is None:
+                seconds = times[value] = time.mktime(value)
+            return seconds
+
+        pack = INODE_RECORD.pack
+        nodes = self.nodes
+        # Breadth-first order keeps the children of each directory together.
+        # Entries are nodes, or record numbers of the loaded file for
+        # children of directories that were never loaded
+        order: List[Union[CatalogNode, int]] = [self.root]
+        i = 0
+        while i < len(order):
+            entry = order[i]
+            i += 1
+            if isinstance(entry, int):
+                (node_id, parent_id, flags, start, first, count, stored_offset, name_length,
+                 create_time, update_time, content_time) = INODE_RECORD.unpack_from(
+                    self._records, entry * INODE_RECORD.size)
+                name_offset = len(heap)
+                heap += self._heap[stored_offset:stored_offset + name_length]
+                if not flags & INODE_FILE:
+                    children = range(first, first + count)
+                    first = len(order)
+                    order.extend(children)
+                records.append(pack(node_id, parent_id, flags, start, first, count,
+                                    name_offset, name_length, create_time, update_time,
+                                    content_time))
+                continue
+            node = entry
+            name = node.name.encode(ENCODING)
+            name_offset = len(heap)
+            heap += name
+            if node.is_file:
+                flags, start, first, count = INODE_FILE, node.data.start, 0, 0
+                content_time = mktime(node.data.update_time)
+            else:
+                flags, start, first, count = 0, -1, len(order), node.child_count
+                content_time = 0.0
+                if node.is_loaded:
+                    order.extend(nodes[child_id] for child_id in node.child_ids)
+                else:
+                    order.extend(self._stored_children(node._record))
+            records.append(pack(node.id, node.parent_id, flags, start, first, count,
+                                name_offset, len(name), mktime(node.create_time),
+                                mktime(node.update_time), content_time))
+        header = CATALOG_HEADER.pack(CATALOG_MAGIC, CATALOG_VERSION, len(records),
+                                     self.next_id, len(heap))
+        return header + b"".join(records) + bytes(heap)
+
+    def take_changes(self) -> Tuple[List[Tuple[CatalogNode, bool]], List[int]]:
+        """
+        Return the nodes added or changed, each with whether it was appended
+        to its directory, and the IDs of the nodes removed since the last
+        call or save, and forget them
+        """
+        nodes = [(self.nodes[node_id], appended) for node_id, appended in self.changed.items()]
+        removed = sorted(self.removed)
+        self.changed.clear()
+        self.removed.clear()
+        return nodes, removed
+
+    def node_change(self, node: CatalogNode, appended: bool = False) -> bytes:
+        """
+        Encode node as a NODE_CHANGE record for the journal
+        """
+        name = node.name.encode(ENCODING)
+        if node.is_file:
+            flags, start, content_time = INODE_FILE, node.data.start, time.mktime(node.data.update_time)
+        else:
+            flags, start, content_time = 0, -1, 0.0
+        if appended:
+            flags |= NODE_APPENDED
+        return NODE_CHANGE.pack(node.id, node.parent_id, flags, start, time.mktime(node.create_time),
+                                time.mktime(node.update_time), content_time, len(name)) + name
+
+    def apply_changes(self, changes: Sequence[Buffer], removed: Sequence[int]) -> None:
+        """
+        Apply node changes encoded by node_change and remove the nodes with
+        the IDs in removed, as replayed from the journal
+
+        Blocks are not freed; the FAT changes logged with the nodes do that.
+        """
+        records = []
+        for raw in changes:
+            fields = NODE_CHANGE.unpack_from(raw, 0)
+            name = bytes(raw[NODE_CHANGE.size:NODE_CHANGE.size + fields[-1]]).decode(ENCODING)
+            records.append(fields[:-1] + (name,))
+
+        # Create the new nodes first, as a directory may be added after its children
+        existing = set()
+        for node_id, parent_id, flags, start, create_time, update_time, content_time, name in records:
+            node = self.find(node_id)
+            if node is None:
+                node = self._new_node(node_id, -1, flags, start, name,
+                                      create_time, update_time, content_time)
+                if not node.is_file:
+                    node.child_ids = {}
+                self.nodes[node_id] = node
+                self.next_id = max(self.next_id, node_id + 1)
+            else:
+                existing.add(node_id)
+
+        # Then put them in place in the order they were put in their directories
+        for node_id, parent_id, flags, start, create_time, update_time, content_time, name in records:
+            node = self.nodes[node_id]
+            if node_id not in existing:
+                self.find(parent_id).add_child(node)
+                continue
+            if node.parent_id != parent_id or (flags & NODE_APPENDED and node_id != ROOT_ID):
+                # Appended again, possibly to the directory it was in
+                self.dentries.invalidate(self.key_of(node))
+                self.nodes[node.parent_id].remove_child(node)
+                node.name = name
+                self.find(parent_id).add_child(node)
+            elif node.name != name:
+                self.dentries.invalidate(self.key_of(node))
+                node.rename(name)
+            node.create_time = self._localtime(create_time)
+            node.update_time = self._localtime(update_time)
+            if node.is_file:
+                node.data.name = name
+                node.data.start = start
+                node.data.update_time = self._localtime(content_time)
+                node.data.extents = None
+
+        for node_id in removed:
+            node = self.find(node_id)
+            if node is None:
+                continue
+            self.dentries.invalidate(self.key_of(node))
+            self.nodes[node.parent_id].remove_child(node)
+            stack = [node]
+            while stack:
+                current = stack.pop()
+                if not current.is_file and current.is_loaded:
+                    stack.extend(self.nodes[child_id] for child_id in current.child_ids)
+                del self.nodes[current.id]
+                current.catalog = None
+        self.changed.clear()
+        self.removed.clear()
+
+    def _register(self, node: CatalogNode) -> None:
+        node.id = self.next_id
+        self.next_id += 1
+        node.catalog = self
+        self.nodes[node.id] = node
+        self.changed[node.id] = True
+
+    @property
+    def root(self) -> CatalogNode:
+        return self.nodes[ROOT_ID]
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def __iter__(self) -> Iterator[CatalogNode]:
+        return iter(self.nodes.values())
+
+    def get(self, node_id: int) -> Optional[CatalogNode]:
+        """
+        Return the node with the given ID, or None
+        """
+        return self.nodes.get(node_id)
+
+    @staticmethod
+    def split(path: Union[str, Sequence[str]]) -> Tuple[str, ...]:
+        """
+        Turn "/a/b/c" or a sequence of names into the tuple of names below the root
+        """
+        if isinstance(path, str):
+            return tuple(name for name in path.split('/') if name)
+        return tuple(path)
+
+    def resolve(self, path: Union[str, Sequence[str]]) -> Optional[CatalogNode]:
+        """
+        Return the node at path, or None if there is none
+        """
+        key = self.split(path)
+        if not key:
+            return self.root
+        node = self.dentries.get(key)
+        if node is not None:
+            return node
+
+        # Start from the deepest cached ancestor
+        depth = len(key) - 1
+        node = None
+        while depth > 0:
+            node = self.dentries.get(key[:depth])
+            if node is not None:
+                break
+            depth -= 1
+        if node is None:
+            node = self.root
+
+        for name in key[depth:]:
+            if node.is_file:
+                return None
+            node = node.get_child(name)
+            if node is None:
+                return None
+        self.dentries.put(key, node)
+        return node
+
+    def key_of(self, node: CatalogNode) -> Tuple[str, ...]:
+        """
+        Return the tuple of names leading from the root to node
+        """
+        names = []
+        while node.parent_id != -1:
+            names.append(node.name)
+            node = self.nodes[node.parent_id]
+        return tuple(reversed(names))
+
+    def path_of(self, node: CatalogNode) -> str:
+        return '/' + '/'.join(self.key_of(node))
+
+    def add(self, parent: CatalogNode, node: CatalogNode) -> None:
+        """
+        Add a new node to directory parent
+        """
+        self._register(node)
+        parent.add_child(node)
+        self.events.publish(NodeCreated(node.id, parent.id))
+
+    def rename(self, node: CatalogNode, name: str) -> None:
+        """
+        Rename node
+        """
+        self.dentries.invalidate(self.key_of(node))
+        old_name = node.name
+        node.rename(name)
+        self.events.publish(NodeRenamed(node.id, old_name, name))
+
+    def move(self, node: CatalogNode, parent: CatalogNode) -> None:
+        """
+        Move node into directory parent, adding a suffix to its name if taken there
+        """
+        if parent.is_file:
+            raise Exception("Cannot move into a file!")
+        ancestor = parent
+        while ancestor is not None:
+            if ancestor is node:
+                raise Exception("Cannot move a folder into itself!")
+            ancestor = ancestor.parent
+        old_parent = node.parent
+        if old_parent is parent:
+            return
+        self.dentries.invalidate(self.key_of(node))
+        old_parent.remove_child(node)
+        name = parent.unique_name(node.name)
+        if name != node.name:
+            node.name = name
+            if node.is_file:
+                node.data.name = name
+        parent.add_child(node)
+        # Appended to its new directory
+        self.changed.pop(node.id, None)
+        self.changed[node.id] = True
+        self.events.publish(NodeMoved(node.id, old_parent.id, parent.id))
+
+    def write(self, node: CatalogNode, data: Union[str, Buffer], fat: FAT, disk: Sequence[Block]) -> None:
+        """
+        Replace the content of file node
+        """
+        node.data.update(data, fat, disk)
+        node.update_time = node.data.update_time
+        node.touch()
+        self.events.publish(ContentUpdated(node.id))
+
+    def remove(self, node: CatalogNode, fat: FAT, disk: Sequence[Block]) -> None:
+        """
+        Remove node and everything below it, freeing the blocks of its files
+        """
+        self.dentries.invalidate(self.key_of(node))
+        parent_id = node.parent_id
+        self.nodes[parent_id].remove_child(node)
+        stack = [node]
+        while stack:
+            current = stack.pop()
+            if current.is_file:
+                current.data.delete(fat, disk)
+            else:
+                stack.extend(self.nodes[child_id] for child_id in current.child_ids)
+            del self.nodes[current.id]
+            self.changed.pop(current.id, None)
+            self.removed.add(current.id)
+            current.catalog = None
+        self.events.publish(NodeDeleted(node.id, parent_id))
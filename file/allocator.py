@@ -0,0 +1,326 @@
+"""
+Block allocation policies
+- FirstFitAllocator: Lowest run of free blocks that fits
+- NextFitAllocator: First run that fits after the last allocation
+- BestFitAllocator: Smallest run of free blocks that fits
+- BuddyAllocator: Power-of-two aligned chunks split and merged with their buddies
+
+A policy chooses where a run of blocks goes; the FAT owns the free-space
+bitmap (1 = free) and tells the policy about every run it reserves and
+every block it releases. When no free run is long enough, a policy returns
+a shorter one and the FAT asks again for the rest.
+"""
+import bisect
+import heapq
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+DEFAULT_POLICY = 'next'
+
+
+def free_runs(free_map: bytearray, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[int, int]]:
+    """
+    Yield (start, length) for each run of free blocks in free_map[start:end]
+    """
+    if end is None:
+        end = len(free_map)
+    pos = free_map.find(1, start, end)
+    while pos != -1:
+        stop = free_map.find(0, pos, end)
+        if stop == -1:
+            stop = end
+        yield pos, stop - pos
+        pos = free_map.find(1, stop, end)
+
+
+def _run_end(free_map: bytearray, start: int) -> int:
+    # End of the free run starting at start
+    stop = free_map.find(0, start)
+    return len(free_map) if stop == -1 else stop
+
+
+class FirstFitAllocator:
+    """
+    Takes the lowest run long enough, or the lowest free run
+
+    When no run is long enough, the length of the longest free run is
+    worked out and kept as a bound, raised as blocks are released, so the
+    remaining extents of a write on a fragmented disk do not search the
+    whole map again. Free runs are then taken from a cursor below which
+    no block is free.
+    """
+    def __init__(self, free_map: bytearray):
+        self.free_map = free_map
+        self.reset()
+
+    def reset(self) -> None:
+        # Upper bound of the longest free run, None if unknown
+        self.longest: Optional[int] = None
+        self.cursor = 0
+
+    def find_run(self, count: int) -> Tuple[int, int]:
+        if self.longest is None or count <= self.longest:
+            start = self._search(b'\x01' * count)
+            if start != -1:
+                return start, count
+            self.longest = self._longest(count)
+        return self._next_run(count)
+
+    def _search(self, pattern: bytes) -> int:
+        return self.free_map.find(pattern)
+
+    def _longest(self, below: int) -> int:
+        # Length of the longest free run, known to be shorter than below
+        low, high = 0, below - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if self.free_map.find(b'\x01' * middle) != -1:
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
+    def _next_run(self, count: int) -> Tuple[int, int]:
+        start = self.free_map.find(1, self.cursor)
+        if start == -1:
+            return -1, 0
+        self.cursor = start
+        return start, min(_run_end(self.free_map, start) - start, count)
+
+    def reserve(self, start: int, length: int) -> None:
+        pass
+
+    def release(self, index: int) -> None:
+        self.release_run(index, 1)
+
+    def release_run(self, start: int, length: int) -> None:
+        # The free run now holding the blocks may be the longest one
+        if self.longest is not None:
+            first = self.free_map.rfind(0, 0, start) + 1
+            self.longest = max(self.longest, _run_end(self.free_map, start) - first)
+        self.cursor = min(self.cursor, start)
+
+
+class NextFitAllocator(FirstFitAllocator):
+    """
+    Searches from a rolling hint just past the last allocation, wrapping
+    around, so consecutive writes land next to each other
+    """
+    def reset(self) -> None:
+        super().reset()
+        self.hint = 0
+
+    def _search(self, pattern: bytes) -> int:
+        start = self.free_map.find(pattern, self.hint)
+        if start == -1:
+            start = self.free_map.find(pattern, 0, self.hint + len(pattern) - 1)
+        return start
+
+    def _next_run(self, count: int) -> Tuple[int, int]:
+        start = self.free_map.find(1, self.hint)
+        if start == -1:
+            start = self.free_map.find(1, 0, self.hint)
+        if start == -1:
+            return -1, 0
+        return start, min(_run_end(self.free_map, start) - start, count)
+
+    def reserve(self, start: int, length: int) -> None:
+        end = start + length
+        self.hint = end if end < len(self.free_map) else 0
+
+
+class BestFitAllocator:
+    """
+    Takes the shortest run long enough, keeping long runs for large files,
+    or the longest free run if none is
+
+    Free runs are indexed by start and end, so released blocks merge with
+    their neighbours, and by length: a sorted list of the lengths there
+    are and a heap of starts per length. Heap entries of runs that changed
+    are dropped when they come to the top.
+    """
+    def __init__(self, free_map: bytearray):
+        self.free_map = free_map
+        self.reset()
+
+    def reset(self) -> None:
+        self.by_start: Dict[int, int] = {}
+        self.by_end: Dict[int, int] = {}
+        self.starts: Dict[int, List[int]] = {}
+        self.counts: Dict[int, int] = {}
+        self.lengths: List[int] = []
+        for start, length in free_runs(self.free_map):
+            self._add(start, length)
+
+    def _add(self, start: int, length: int) -> None:
+        self.by_start[start] = length
+        self.by_end[start + length] = start
+        heap = self.starts.setdefault(length, [])
+        heapq.heappush(heap, start)
+        count = self.counts.get(length, 0) + 1
+        self.counts[length] = count
+        if count == 1:
+            bisect.insort(self.lengths, length)
+        elif len(heap) > 2 * count + 8:
+            # Mostly stale entries, keep the live ones
+            heap[:] = sorted(s for s in set(heap) if self.by_start.get(s) == length)
+
+    def _remove(self, start: int) -> int:
+        length = self.by_start.pop(start)
+        del self.by_end[start + length]
+        self.counts[length] -= 1
+        if not self.counts[length]:
+            del self.counts[length]
+            del self.starts[length]
+            del self.lengths[bisect.bisect_left(self.lengths, length)]
+        return length
+
+    def _lowest(self, length: int) -> int:
+        # Lowest start of a run of length
+        heap = self.starts[length]
+        while self.by_start.get(heap[0]) != length:
+            heapq.heappop(heap)
+        return heap[0]
+
+    def find_run(self, count: int) -> Tuple[int, int]:
+        if not self.lengths:
+            return -1, 0
+        i = bisect.bisect_left(self.lengths, count)
+        if i < len(self.lengths):
+            return self._lowest(self.lengths[i]), count
+        length = self.lengths[-1]
+        return self._lowest(length), length
+
+    def reserve(self, start: int, length: int) -> None:
+        # The FAT has already marked the blocks used, the run began after the last used block before them
+        first = self.free_map.rfind(0, 0, start) + 1
+        end = first + self._remove(first)
+        if first < start:
+            self._add(first, start - first)
+        if start + length < end:
+            self._add(start + length, end - start - length)
+
+    def release(self, index: int) -> None:
+        self.release_run(index, 1)
+
+    def release_run(self, start: int, length: int) -> None:
+        end = start + length
+        if start in self.by_end:
+            start = self.by_end[start]
+            self._remove(start)
+        if end in self.by_start:
+            end += self._remove(end)
+        self._add(start, end - start)
+
+
+class BuddyAllocator:
+    """
+    Binary buddy allocator over the blocks
+
+    Free space is kept as lists of free chunks per order, a chunk of order
+    k being 2**k blocks aligned on 2**k. A run is carved from the smallest
+    chunk that holds it, splitting larger ones, and the unused tail is given
+    back as smaller chunks; a released block merges with its buddy as long
+    as the buddy is free, so free space stays in few large aligned chunks.
+    Each order also keeps a heap of its chunk starts to find the lowest
+    one; entries of chunks taken meanwhile are dropped when they come to
+    the top.
+    """
+    def __init__(self, free_map: bytearray):
+        self.free_map = free_map
+        self.free: List[Set[int]] = []
+        self.starts: List[List[int]] = []
+        self.chunk: Optional[Tuple[int, int]] = None
+        self.reset()
+
+    def reset(self) -> None:
+        self.free = [set() for _ in range(max(1, len(self.free_map)).bit_length())]
+        self.starts = [[] for _ in self.free]
+        for start, length in free_runs(self.free_map):
+            self._add_range(start, start + length)
+        self.chunk = None
+
+    def _add_range(self, pos: int, end: int) -> None:
+        # Split [pos, end) into the largest aligned chunks
+        while pos < end:
+            order = (pos & -pos).bit_length() - 1 if pos else len(self.free) - 1
+            while pos + (1 << order) > end:
+                order -= 1
+            self._add(order, pos)
+            pos += 1 << order
+
+    def _add(self, order: int, start: int) -> None:
+        chunks = self.free[order]
+        chunks.add(start)
+        heap = self.starts[order]
+        heapq.heappush(heap, start)
+        if len(heap) > 2 * len(chunks) + 8:
+            # Mostly stale entries, keep the live ones
+            heap[:] = sorted(chunks)
+
+    def _lowest(self, order: int) -> int:
+        # Lowest start of a free chunk of order
+        chunks = self.free[order]
+        heap = self.starts[order]
+        while heap[0] not in chunks:
+            heapq.heappop(heap)
+        return heap[0]
+
+    def find_run(self, count: int) -> Tuple[int, int]:
+        need = max(0, (count - 1).bit_length())
+        for order in range(min(need, len(self.free) - 1), len(self.free)):
+            if self.free[order]:
+                start = self._lowest(order)
+                self.chunk = (start, order)
+                return start, min(count, 1 << order)
+        # Nothing large enough, take the largest chunk there is
+        for order in range(min(need, len(self.free)) - 1, -1, -1):
+            if self.free[order]:
+                start = self._lowest(order)
+                self.chunk = (start, order)
+                return start, 1 << order
+        return -1, 0
+
+    def reserve(self, start: int, length: int) -> None:
+        if self.chunk is None or self.chunk[0] != start:
+            # Not chosen by find_run, take the blocks out of their chunks one by one
+            self.chunk = None
+            for index in range(start, start + length):
+                self._claim(index)
+            return
+        chunk_start, order = self.chunk
+        self.chunk = None
+        self.free[order].discard(chunk_start)
+        self._add_range(start + length, chunk_start + (1 << order))
+
+    def _claim(self, index: int) -> None:
+        # Split the free chunk holding index around it
+        for order, chunks in enumerate(self.free):
+            chunk_start = index & ~((1 << order) - 1)
+            if chunk_start in chunks:
+                chunks.remove(chunk_start)
+                self._add_range(chunk_start, index)
+                self._add_range(index + 1, chunk_start + (1 << order))
+                return
+
+    def release(self, index: int) -> None:
+        order = 0
+        while order < len(self.free) - 1:
+            buddy = index ^ (1 << order)
+            if buddy not in self.free[order]:
+                break
+            self.free[order].remove(buddy)
+            index = min(index, buddy)
+            order += 1
+        self._add(order, index)
+
+    def release_run(self, start: int, length: int) -> None:
+        for index in range(start, start + length):
+            self.release(index)
+
+
+ALLOCATORS = {
+    'first': FirstFitAllocator,
+    'next': NextFitAllocator,
+    'best': BestFitAllocator,
+    'buddy': BuddyAllocator,
+}
@@ -0,0 +1,466 @@
+"""
+Benchmarks of the file system core
+
+    python benchmark.py allocators [--ops N] [--seed S] [--json]
+    python benchmark.py defrag [--ops N] [--seed S] [--json]
+    python benchmark.py core [--blocks N ...] [--sizes D ...] [--ops N] [--seed S] [--json] [--output FILE]
+
+allocators: runs the same random workload of file creations, appends and
+deletions against every block allocation policy and reports allocation
+latency and the fragmentation it leaves behind.
+
+defrag: fragments a volume through the catalog with creations, rewrites
+and deletions, defragments it step by step and reports the fragmentation
+before and after, the blocks moved and the longest pause of a step.
+
+core: times the hot paths of the file system (FAT.write, read, update and
+delete, find_blank on nearly full volumes, FCB.update on a large file,
+directory lookup, catalog save and load, and building the whole directory
+tree) once per volume size and file size distribution, so results of two
+versions can be compared op by op.
+
+Every benchmark is seeded and prints a table, or JSON with --json; --output
+also writes the JSON results to a file.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Sequence
+
+from allocator import ALLOCATORS, DEFAULT_POLICY
+from defrag import Defragmenter, fragmentation
+from File import BLOCK_NUM, BLOCK_SIZE, Catalog, CatalogNode, Disk, FAT, FCB
+from telemetry import summarize
+
+# File sizes of the core benchmark, in blocks
+SIZE_DISTRIBUTIONS = {
+    'small': (1,),
+    'mixed': (1, 1, 1, 2, 2, 3, 4, 6, 8, 16),
+    'large': (16, 32, 64, 128),
+}
+
+
+def run_allocator_workload(policy: str, ops: int, seed: int, workdir: str,
+                           block_size: int = BLOCK_SIZE, block_num: int = BLOCK_NUM) -> Dict[str, Any]:
+    """
+    Fill the volume to about two thirds with files, then apply ops random
+    creations, appends and deletions, timing every allocating call
+    """
+    rng = random.Random(seed)
+    fat = FAT(policy, block_num)
+    disk = Disk.create(os.path.join(workdir, f'disk-{policy}'), block_size, block_num)
+    files: List[FCB] = []
+    samples: List[int] = []
+    failures = 0
+    payload = bytes(range(256)) * (16 * block_size // 256 + 1)
+    now = time.localtime()
+
+    def size() -> int:
+        # Mostly small files with the odd large one
+        blocks = rng.choice((1, 1, 1, 2, 2, 3, 4, 6, 8, 16))
+        return rng.randint((blocks - 1) * block_size + 1, blocks * block_size)
+
+    def create() -> None:
+        nonlocal failures
+        data = payload[:size()]
+        begin = time.perf_counter_ns()
+        try:
+            fcb = FCB(f'f{len(files)}', now, data, fat, disk)
+        except Exception:
+            failures += 1
+            return
+        samples.append(time.perf_counter_ns() - begin)
+        files.append(fcb)
+
+    def append() -> None:
+        nonlocal failures
+        fcb = rng.choice(files)
+        data = payload[:rng.randint(1, 2 * block_size)]
+        begin = time.perf_counter_ns()
+        try:
+            with fcb.open(fat, disk, 'a') as handle:
+                handle.write(data)
+        except Exception:
+            failures += 1
+            return
+        samples.append(time.perf_counter_ns() - begin)
+
+    def delete() -> None:
+        fcb = files.pop(rng.randrange(len(files)))
+        fcb.delete(fat, disk)
+
+    while fat.free_count > block_num // 3:
+        create()
+    for _ in range(ops):
+        roll = rng.random()
+        if not files or roll < 0.4:
+            create()
+        elif roll < 0.7:
+            append()
+        else:
+            delete()
+        # Keep the volume from filling up for good
+        while fat.free_count < block_num // 8 and files:
+            delete()
+
+    result = {'policy': policy, 'ops': ops, 'seed': seed, 'failures': failures,
+              'latency': summarize(samples)}
+    result.update(fragmentation(fat, [fcb.start for fcb in files]))
+    disk.close()
+    return result
+
+
+def bench_allocators(policies: Sequence[str], ops: int, seed: int,
+                     block_size: int = BLOCK_SIZE, block_num: int = BLOCK_NUM) -> List[Dict[str, Any]]:
+    """
+    Run the allocation workload once per policy with the same seed
+    """
+    workdir = tempfile.mkdtemp(prefix='fs-bench-')
+    try:
+        return [run_allocator_workload(policy, ops, seed, workdir, block_size, block_num)
+                for policy in policies]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _print_allocators(results: List[Dict[str, Any]]) -> None:
+    header = f"{'policy':<8} {'mean us':>9} {'p99 us':>9} {'extents/file':>13} {'free runs':>10} {'largest run':>12} {'ext frag':>9} {'failed':>7}"
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        print(f"{r['policy']:<8} {r['latency']['mean_us']:>9.1f} {r['latency']['p99_us']:>9.1f} "
+              f"{r['avg_extents_per_file']:>13.2f} {r['free_runs']:>10} {r['largest_free_run']:>12} "
+              f"{r['external_fragmentation']:>9.2f} {r['failures']:>7}")
+
+
+def run_defrag(policy: str, ops: int, seed: int, workdir: str,
+               block_size: int = BLOCK_SIZE, block_num: int = BLOCK_NUM) -> Dict[str, Any]:
+    """
+    Fragment a volume with ops random creations, rewrites and deletions of
+    files in the catalog, then defragment it in steps
+    """
+    rng = random.Random(seed)
+    fat = FAT(policy, block_num)
+    disk = Disk.create(os.path.join(workdir, f'disk-{policy}'), block_size, block_num)
+    now = time.localtime()
+    catalog = Catalog(CatalogNode('root', False, fat, disk, now))
+    root = catalog.root
+    payload = bytes(range(256)) * (8 * block_size // 256 + 1)
+    files: List[CatalogNode] = []
+
+    for i in range(ops):
+        roll = rng.random()
+        if files and (roll < 0.3 or fat.free_count < block_num // 4):
+            catalog.remove(files.pop(rng.randrange(len(files))), fat, disk)
+        elif files and roll < 0.6:
+            node = rng.choice(files)
+            catalog.write(node, payload[:rng.randint(1, 8 * block_size)], fat, disk)
+        else:
+            node = CatalogNode(f'f{i}', True, fat, disk, now, root,
+                               payload[:rng.randint(1, 8 * block_size)])
+            catalog.add(root, node)
+            files.append(node)
+    contents = {node.id: node.data.read_bytes(fat, disk) for node in files}
+
+    defragmenter = Defragmenter(catalog, fat, disk)
+    steps = 0
+    pauses = []
+    begin = time.perf_counter()
+    done = False
+    while not done:
+        start = time.perf_counter_ns()
+        done = defragmenter.step()
+        pauses.append(time.perf_counter_ns() - start)
+        steps += 1
+    elapsed = time.perf_counter() - begin
+    defragmenter.close()
+    intact = all(node.data.read_bytes(fat, disk) == contents[node.id] for node in files)
+    disk.close()
+    return {'policy': policy, 'ops': ops, 'seed': seed, 'before': defragmenter.before,
+            'after': defragmenter.after, 'moved_blocks': defragmenter.moved,
+            'incomplete': defragmenter.incomplete, 'intact': intact, 'steps': steps,
+            'max_pause_ms': max(pauses) / 1e6, 'total_s': elapsed}
+
+
+def bench_defrag(policies: Sequence[str], ops: int, seed: int,
+                 block_size: int = BLOCK_SIZE, block_num: int = BLOCK_NUM) -> List[Dict[str, Any]]:
+    """
+    Run the defragmentation benchmark once per policy with the same seed
+    """
+    workdir = tempfile.mkdtemp(prefix='fs-bench-')
+    try:
+        return [run_defrag(policy, ops, seed, workdir, block_size, block_num) for policy in policies]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _print_defrag(results: List[Dict[str, Any]]) -> None:
+    header = f"{'policy':<8} {'extents/file':>17} {'fragmented':>13} {'free runs':>11} {'moved':>7} {'steps':>6} {'max pause ms':>13}"
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        before, after = r['before'], r['after']
+        print(f"{r['policy']:<8} {before['avg_extents_per_file']:>7.2f} -> {after['avg_extents_per_file']:>6.2f} "
+              f"{before['fragmented_files']:>5} -> {after['fragmented_files']:>4} "
+              f"{before['free_runs']:>4} -> {after['free_runs']:>4} {r['moved_blocks']:>7} "
+              f"{r['steps']:>6} {r['max_pause_ms']:>13.2f}")
+
+
+def _timer(samples: Dict[str, List[int]], op: str) -> Callable[..., Any]:
+    # Call a function and add its latency to the samples of op
+    ops = samples.setdefault(op, [])
+
+    def call(function: Callable[..., Any], *args) -> Any:
+        begin = time.perf_counter_ns()
+        result = function(*args)
+        ops.append(time.perf_counter_ns() - begin)
+        return result
+    return call
+
+
+def _bench_fat(samples: Dict[str, List[int]], policy: str, block_num: int, block_size: int,
+               blocks: Sequence[int], ops: int, rng: random.Random, workdir: str) -> Dict[str, int]:
+    """
+    Fill a volume to two thirds with FAT.write, then time random reads,
+    updates and deletions, and FCB.update of a large file
+    """
+    fat = FAT(policy, block_num)
+    disk = Disk.create(os.path.join(workdir, 'disk'), block_size, block_num)
+    payload = bytes(range(256)) * (max(blocks) * block_size // 128 + 1)
+    starts: List[int] = []
+    failures = 0
+
+    def data() -> memoryview:
+        count = rng.choice(blocks)
+        offset = rng.randrange(256)
+        return memoryview(payload)[offset:offset + rng.randint((count - 1) * block_size + 1, count * block_size)]
+
+    write = _timer(samples, 'fat_write')
+    while fat.free_count > block_num // 3:
+        content = data()
+        if -(-len(content) // block_size) > fat.free_count:
+            break
+        starts.append(write(fat.write, content, disk))
+    files = len(starts)
+
+    read = _timer(samples, 'fat_read')
+    update = _timer(samples, 'fat_update')
+    for _ in range(ops):
+        i = rng.randrange(len(starts))
+        read(fat.read, starts[i], disk)
+        try:
+            starts[i] = update(fat.update, starts[i], data(), disk)
+        except Exception:
+            failures += 1
+
+    delete = _timer(samples, 'fat_delete')
+    for _ in range(min(ops, len(starts))):
+        delete(fat.delete, starts.pop(rng.randrange(len(starts))), disk)
+    for start in starts:
+        fat.delete(start, disk)
+
+    # Rewrite one block, grow by an eighth and shrink back, in the free space left fragmented above
+    length = max(1, min(block_num // 8, 1 << 14)) * block_size
+    content = bytearray(payload[:length] * (-(-length // len(payload)) + 1))
+    fcb = FCB('large', time.localtime(), content[:length], fat, disk)
+    update = _timer(samples, 'fcb_update_large')
+    for i in range(max(3, ops // 100)):
+        if i % 3 == 0:
+            content[rng.randrange(length)] ^= 0xff
+            update(fcb.update, content[:length], fat, disk)
+        elif i % 3 == 1:
+            update(fcb.update, content[:length + length // 8], fat, disk)
+        else:
+            update(fcb.update, content[:length], fat, disk)
+    disk.close()
+    return {'files': files, 'failures': failures}
+
+
+def _bench_find_blank(samples: Dict[str, List[int]], policy: str, block_num: int,
+                      ops: int, rng: random.Random) -> None:
+    """
+    Time find_blank with 1% of the blocks free and with a single free block
+    Each search is followed by taking the block found and freeing a random
+    used one, so the volume stays as full while the policy's cursor moves on.
+    """
+    fat = FAT(policy, block_num)
+    while fat.free_count:
+        fat.allocate_run(fat.free_count)
+    for label, free in (('find_blank_99pct', max(1, block_num // 100)), ('find_blank_last', 1)):
+        while fat.free_count < free:
+            fat.release(rng.randrange(block_num))
+        while fat.free_count > free:
+            fat.allocate()
+        find = _timer(samples, label)
+        for _ in range(ops):
+            find(fat.find_blank)
+            fat.allocate()
+            index = rng.randrange(block_num)
+            while fat.free_map[index]:
+                index = rng.randrange(block_num)
+            fat.release(index)
+
+
+def _bench_catalog(samples: Dict[str, List[int]], nodes: int, ops: int,
+                   rng: random.Random, workdir: str) -> None:
+    """
+    Time saving and loading a catalog of nodes empty files and directories,
+    resolving paths in it and loading the whole directory tree
+    """
+    fat = FAT(DEFAULT_POLICY, 1)
+    now = time.localtime()
+    catalog = Catalog(CatalogNode('root', False, fat, [], now))
+    directories = [catalog.root]
+    paths: List[str] = []
+    for i in range(1, nodes):
+        parent = directories[rng.randrange(len(directories))]
+        # About one node in sixteen is a directory
+        node = CatalogNode(f'n{i}', i % 16 != 0, fat, [], now, parent)
+        catalog.add(parent, node)
+        if node.is_file:
+            paths.append(catalog.path_of(node))
+        else:
+            directories.append(node)
+    lookups = [rng.choice(paths) for _ in range(ops)]
+    path = os.path.join(workdir, 'catalog')
+
+    save = _timer(samples, 'catalog_save')
+    load = _timer(samples, 'catalog_load')
+    build = _timer(samples, 'tree_build')
+    for _ in range(5):
+        save(catalog.save, path)
+        load(Catalog.load, path)
+        build(_load_tree, Catalog.load(path))
+
+    # Cold lookups read directories from the catalog file, warm ones hit the dentry cache
+    loaded = Catalog.load(path)
+    cold = _timer(samples, 'lookup_cold')
+    for name in lookups:
+        cold(loaded.resolve, name)
+    warm = _timer(samples, 'lookup_warm')
+    for name in lookups:
+        warm(loaded.resolve, name)
+
+
+def _load_tree(catalog: Catalog) -> int:
+    # Bring every node into memory, as expanding the whole directory tree does
+    count = 0
+    stack = [catalog.root]
+    while stack:
+        node = stack.pop()
+        count += 1
+        if not node.is_file:
+            stack.extend(node.children)
+    return count
+
+
+def run_core(policy: str, block_num: int, distribution: str, ops: int, nodes: int, seed: int,
+             workdir: str, block_size: int = BLOCK_SIZE) -> Dict[str, Any]:
+    """
+    Time the hot paths of the file system on one volume geometry and file size distribution
+    """
+    rng = random.Random(seed)
+    samples: Dict[str, List[int]] = {}
+    result = {'policy': policy, 'blocks': block_num, 'block_size': block_size,
+              'distribution': distribution, 'ops': ops, 'nodes': nodes, 'seed': seed}
+    result.update(_bench_fat(samples, policy, block_num, block_size,
+                             SIZE_DISTRIBUTIONS[distribution], ops, rng, workdir))
+    _bench_find_blank(samples, policy, block_num, ops, rng)
+    _bench_catalog(samples, nodes, ops, rng, workdir)
+    result['latency'] = {op: summarize(values) for op, values in samples.items()}
+    return result
+
+
+def bench_core(policies: Sequence[str], volumes: Sequence[int], distributions: Sequence[str],
+               ops: int, nodes: int, seed: int, block_size: int = BLOCK_SIZE) -> List[Dict[str, Any]]:
+    """
+    Run the core benchmark for every policy, volume size and distribution with the same seed
+    """
+    workdir = tempfile.mkdtemp(prefix='fs-bench-')
+    try:
+        return [run_core(policy, block_num, distribution, ops, nodes, seed, workdir, block_size)
+                for policy in policies for block_num in volumes for distribution in distributions]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _print_core(results: List[Dict[str, Any]]) -> None:
+    for r in results:
+        print(f"{r['policy']} policy, {r['blocks']} blocks of {r['block_size']} bytes, "
+              f"{r['distribution']} files ({r['files']} written, {r['failures']} failed updates)")
+        header = f"  {'operation':<18} {'count':>7} {'mean us':>10} {'p50 us':>10} {'p99 us':>10} {'max us':>10}"
+        print(header)
+        print('  ' + '-' * (len(header) - 2))
+        for op, figures in r['latency'].items():
+            print(f"  {op:<18} {figures['count']:>7} {figures['mean_us']:>10.1f} {figures['p50_us']:>10.1f} "
+                  f"{figures['p99_us']:>10.1f} {figures['max_us']:>10.1f}")
+        print()
+
+
+def main(argv: Sequence[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    sub = parser.add_subparsers(dest='command', required=True)
+    alloc = sub.add_parser('allocators', help='compare block allocation policies')
+    alloc.add_argument('--ops', type=int, default=5000, help='operations after the initial fill')
+    alloc.add_argument('--seed', type=int, default=1)
+    alloc.add_argument('--policy', action='append', choices=list(ALLOCATORS),
+                       help='policy to run, may be repeated (default: all)')
+    alloc.add_argument('--json', action='store_true', help='print results as JSON')
+    alloc.add_argument('--block-size', type=int, default=BLOCK_SIZE)
+    alloc.add_argument('--blocks', type=int, default=BLOCK_NUM, help='number of blocks of the volume')
+    defrag = sub.add_parser('defrag', help='fragment a volume and defragment it')
+    defrag.add_argument('--ops', type=int, default=2000, help='catalog operations before defragmenting')
+    defrag.add_argument('--seed', type=int, default=1)
+    defrag.add_argument('--policy', action='append', choices=list(ALLOCATORS),
+                        help='policy to run, may be repeated (default: all)')
+    defrag.add_argument('--json', action='store_true', help='print results as JSON')
+    defrag.add_argument('--block-size', type=int, default=BLOCK_SIZE)
+    defrag.add_argument('--blocks', type=int, default=BLOCK_NUM, help='number of blocks of the volume')
+    core = sub.add_parser('core', help='time the hot paths of the file system')
+    core.add_argument('--ops', type=int, default=2000, help='timed calls per operation')
+    core.add_argument('--seed', type=int, default=1)
+    core.add_argument('--policy', action='append', choices=list(ALLOCATORS),
+                      help=f'policy to run, may be repeated (default: {DEFAULT_POLICY})')
+    core.add_argument('--json', action='store_true', help='print results as JSON')
+    core.add_argument('--block-size', type=int, default=BLOCK_SIZE)
+    core.add_argument('--blocks', type=int, action='append',
+                      help=f'number of blocks of the volume, may be repeated (default: {BLOCK_NUM} and 65536)')
+    core.add_argument('--sizes', action='append', choices=list(SIZE_DISTRIBUTIONS),
+                      help='file size distribution, may be repeated (default: mixed)')
+    core.add_argument('--nodes', type=int, default=10000, help='files and directories of the catalog')
+    for command in (alloc, defrag, core):
+        command.add_argument('--output', metavar='FILE', help='also write the results as JSON to FILE')
+    args = parser.parse_args(argv)
+
+    if args.command == 'allocators':
+        results = bench_allocators(args.policy or list(ALLOCATORS), args.ops, args.seed,
+                                   args.block_size, args.blocks)
+        printer = _print_allocators
+    elif args.command == 'defrag':
+        results = bench_defrag(args.policy or list(ALLOCATORS), args.ops, args.seed,
+                               args.block_size, args.blocks)
+        printer = _print_defrag
+    else:
+        results = bench_core(args.policy or [DEFAULT_POLICY], args.blocks or [BLOCK_NUM, 1 << 16],
+                             args.sizes or ['mixed'], args.ops, args.nodes, args.seed, args.block_size)
+        printer = _print_core
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'command': args.command, 'python': platform.python_version(),
+                       'machine': platform.machine(), 'results': results}, f, indent=2)
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    else:
+        printer(results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
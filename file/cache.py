@@ -0,0 +1,221 @@
+"""
+Block buffer cache
+- BlockCache: Bounded write-back cache of blocks with hit/miss counters
+- LRUPolicy, ClockPolicy, TwoQPolicy: Eviction policies
+"""
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+DEFAULT_CAPACITY = 1024
+
+
+class LRUPolicy:
+    """
+    Evicts the least recently used block
+    """
+    def __init__(self, capacity: int):
+        self.order: 'OrderedDict[int, None]' = OrderedDict()
+
+    def insert(self, key: int) -> None:
+        self.order[key] = None
+
+    def touch(self, key: int) -> None:
+        self.order.move_to_end(key)
+
+    def remove(self, key: int) -> None:
+        del self.order[key]
+
+    def victim(self) -> int:
+        key, _ = self.order.popitem(last=False)
+        return key
+
+
+class ClockPolicy:
+    """
+    Second-chance (CLOCK) approximation of LRU
+
+    Blocks sit in a ring of slots with a reference bit; the hand clears
+    set bits as it sweeps and evicts the first block found with a clear bit.
+    """
+    def __init__(self, capacity: int):
+        self.slots: List[Optional[int]] = []
+        self.slot_of: Dict[int, int] = {}
+        self.referenced: Dict[int, bool] = {}
+        self.free_slots: List[int] = []
+        self.hand = 0
+
+    def insert(self, key: int) -> None:
+        if self.free_slots:
+            slot = self.free_slots.pop()
+            self.slots[slot] = key
+        else:
+            slot = len(self.slots)
+            self.slots.append(key)
+        self.slot_of[key] = slot
+        self.referenced[key] = False
+
+    def touch(self, key: int) -> None:
+        self.referenced[key] = True
+
+    def remove(self, key: int) -> None:
+        slot = self.slot_of.pop(key)
+        del self.referenced[key]
+        self.slots[slot] = None
+        self.free_slots.append(slot)
+
+    def victim(self) -> int:
+        while True:
+            if self.hand >= len(self.slots):
+                self.hand = 0
+            key = self.slots[self.hand]
+            self.hand += 1
+            if key is None:
+                continue
+            if self.referenced[key]:
+                self.referenced[key] = False
+                continue
+            self.remove(key)
+            return key
+
+
+class TwoQPolicy:
+    """
+    Simplified 2Q: blocks seen once wait in a FIFO queue and only move to
+    the LRU queue when referenced again, so a single scan over a large file
+    does not flush the frequently used blocks
+    """
+    def __init__(self, capacity: int):
+        self.in_limit = max(1, capacity // 4)
+        self.out_limit = max(1, capacity // 2)
+        self.a1_in: 'OrderedDict[int, None]' = OrderedDict()
+        self.a1_out: 'OrderedDict[int, None]' = OrderedDict()
+        self.am: 'OrderedDict[int, None]' = OrderedDict()
+
+    def insert(self, key: int) -> None:
+        if key in self.a1_out:
+            del self.a1_out[key]
+            self.am[key] = None
+        else:
+            self.a1_in[key] = None
+
+    def touch(self, key: int) -> None:
+        if key in self.am:
+            self.am.move_to_end(key)
+
+    def remove(self, key: int) -> None:
+        if key in self.am:
+            del self.am[key]
+        else:
+            del self.a1_in[key]
+
+    def victim(self) -> int:
+        if self.a1_in and (len(self.a1_in) > self.in_limit or not self.am):
+            key, _ = self.a1_in.popitem(last=False)
+            # Remember it, a quick second reference promotes it to am
+            self.a1_out[key] = None
+            if len(self.a1_out) > self.out_limit:
+                self.a1_out.popitem(last=False)
+            return key
+        key, _ = self.am.popitem(last=False)
+        return key
+
+
+POLICIES = {
+    'lru': LRUPolicy,
+    'clock': ClockPolicy,
+    '2q': TwoQPolicy,
+}
+
+
+class BlockCache:
+    """
+    Bounded cache of Block objects between the FAT and the block store
+
+    Misses are filled by load(index). Blocks modified while cached carry a
+    dirty bit and are handed to write_back(block) when they are evicted or
+    when flush() is called, so changes are written once rather than on
+    every modification.
+    """
+    def __init__(self, load: Callable[[int], Any], write_back: Callable[[Any], None],
+                 capacity: int = DEFAULT_CAPACITY, policy: str = 'lru'):
+        if capacity < 1:
+            raise ValueError("cache capacity must be positive")
+        if policy not in POLICIES:
+            raise ValueError(f"unknown eviction policy: {policy!r}")
+        self.load = load
+        self.write_back = write_back
+        self.capacity = capacity
+        self.policy_name = policy
+        self.policy = POLICIES[policy](capacity)
+        self.blocks: Dict[int, Any] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self.blocks)
+
+    def __contains__(self, index: int) -> bool:
+        return index in self.blocks
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self.blocks.values())
+
+    def get(self, index: int) -> Any:
+        """
+        Return the block at index, loading it on a miss
+        """
+        block = self.blocks.get(index)
+        if block is not None:
+            self.hits += 1
+            self.policy.touch(index)
+            return block
+
+        self.misses += 1
+        block = self.load(index)
+        if len(self.blocks) >= self.capacity:
+            self.evict()
+        self.blocks[index] = block
+        self.policy.insert(index)
+        return block
+
+    def evict(self) -> None:
+        """
+        Drop the block chosen by the eviction policy, writing it back if dirty
+        """
+        index = self.policy.victim()
+        block = self.blocks.pop(index)
+        self.evictions += 1
+        if block.dirty:
+            self.write_back(block)
+
+    def flush(self) -> None:
+        """
+        Write back every dirty block, keeping them cached
+        """
+        for block in self.blocks.values():
+            if block.dirty:
+                self.write_back(block)
+
+    def clear(self) -> None:
+        """
+        Drop every cached block without writing anything back
+        """
+        self.blocks.clear()
+        self.policy = POLICIES[self.policy_name](self.capacity)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return cache counters
+        """
+        lookups = self.hits + self.misses
+        return {
+            'policy': self.policy_name,
+            'capacity': self.capacity,
+            'cached': len(self.blocks),
+            'dirty': sum(1 for block in self.blocks.values() if block.dirty),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
@@ -0,0 +1,153 @@
+"""
+Command-line access to a volume, without Qt
+
+    python cli.py [-C DIR] ls [-l] [PATH]
+    python cli.py [-C DIR] cat PATH
+    python cli.py [-C DIR] put LOCAL [DEST]
+    python cli.py [-C DIR] get SRC [LOCAL]
+    python cli.py [-C DIR] rm [-r] PATH
+    python cli.py [-C DIR] mkdir [-p] PATH
+    python cli.py [-C DIR] stat [--json] PATH
+    python cli.py [-C DIR] df [--json]
+
+The volume is the fat, disk, catalog and journal files in DIR (default: the
+current directory). Commands that change the volume save it before exiting.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Sequence
+
+from volume import Volume
+
+# Commands that change the volume
+WRITING = ('put', 'rm', 'mkdir')
+
+
+def _ls(volume: Volume, args) -> None:
+    node = volume.resolve(args.path)
+    for child in (node.children if not node.is_file else [node]):
+        name = child.name if child.is_file else child.name + '/'
+        if args.long:
+            size = child.data.size(volume.fat, volume.disk) if child.is_file else child.child_count
+            modified = time.strftime('%Y-%m-%d %H:%M', child.update_time)
+            print(f"{'-' if child.is_file else 'd'} {size:>10} {modified} {name}")
+        else:
+            print(name)
+
+
+def _cat(volume: Volume, args) -> None:
+    sys.stdout.buffer.write(volume.read(args.path))
+    sys.stdout.flush()
+
+
+def _put(volume: Volume, args) -> None:
+    with open(args.local, 'rb') as f:
+        data = f.read()
+    dest = args.dest or os.path.basename(args.local)
+    if dest.endswith('/'):
+        dest += os.path.basename(args.local)
+    else:
+        try:
+            if not volume.resolve(dest).is_file:
+                dest += '/' + os.path.basename(args.local)
+        except FileNotFoundError:
+            pass
+    volume.write(dest, data)
+
+
+def _get(volume: Volume, args) -> None:
+    data = volume.read(args.src)
+    if args.local == '-':
+        sys.stdout.buffer.write(data)
+        sys.stdout.flush()
+        return
+    local = args.local or os.path.basename(args.src.rstrip('/'))
+    if os.path.isdir(local):
+        local = os.path.join(local, os.path.basename(args.src.rstrip('/')))
+    with open(local, 'wb') as f:
+        f.write(data)
+
+
+def _rm(volume: Volume, args) -> None:
+    volume.remove(args.path, args.recursive)
+
+
+def _mkdir(volume: Volume, args) -> None:
+    volume.mkdir(args.path, args.parents)
+
+
+def _stat(volume: Volume, args) -> None:
+    info = volume.stat(args.path)
+    if args.json:
+        json.dump(info, sys.stdout, indent=2)
+        print()
+    else:
+        for key, value in info.items():
+            print(f"{key + ':':<10} {value}")
+
+
+def _df(volume: Volume, args) -> None:
+    info = volume.df()
+    if args.json:
+        json.dump(info, sys.stdout, indent=2)
+        print()
+    else:
+        print(f"{'blocks':>10} {'used':>10} {'free':>10} {'use%':>5}  block size  policy")
+        use = 100 * info['used_blocks'] / info['total_blocks']
+        print(f"{info['total_blocks']:>10} {info['used_blocks']:>10} {info['free_blocks']:>10} {use:>4.0f}%"
+              f"  {info['block_size']:>10}  {info['policy']}")
+
+
+COMMANDS = {'ls': _ls, 'cat': _cat, 'put': _put, 'get': _get, 'rm': _rm,
+            'mkdir': _mkdir, 'stat': _stat, 'df': _df}
+
+
+def main(argv: Sequence[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('-C', '--volume', default='.', metavar='DIR',
+                        help='directory holding the volume files')
+    sub = parser.add_subparsers(dest='command', required=True)
+    ls = sub.add_parser('ls', help='list a directory')
+    ls.add_argument('path', nargs='?', default='/')
+    ls.add_argument('-l', dest='long', action='store_true', help='show type, size and modification time')
+    cat = sub.add_parser('cat', help='print a file')
+    cat.add_argument('path')
+    put = sub.add_parser('put', help='copy a local file into the volume')
+    put.add_argument('local')
+    put.add_argument('dest', nargs='?', help='file or directory in the volume (default: the local name in /)')
+    get = sub.add_parser('get', help='copy a file out of the volume')
+    get.add_argument('src')
+    get.add_argument('local', nargs='?', help="local file or directory, '-' for stdout")
+    rm = sub.add_parser('rm', help='remove a file or directory')
+    rm.add_argument('path')
+    rm.add_argument('-r', dest='recursive', action='store_true', help='remove directories that are not empty')
+    mkdir = sub.add_parser('mkdir', help='create a directory')
+    mkdir.add_argument('path')
+    mkdir.add_argument('-p', dest='parents', action='store_true', help='create missing parents')
+    stat = sub.add_parser('stat', help='describe a file or directory')
+    stat.add_argument('path')
+    stat.add_argument('--json', action='store_true', help='print as JSON')
+    df = sub.add_parser('df', help='show the size and free space of the volume')
+    df.add_argument('--json', action='store_true', help='print as JSON')
+    args = parser.parse_args(argv)
+
+    try:
+        volume = Volume(args.volume, create=False)
+    except (OSError, ValueError) as e:
+        print(f"{parser.prog}: cannot open volume in {args.volume}: {e}", file=sys.stderr)
+        return 1
+    try:
+        COMMANDS[args.command](volume, args)
+    except Exception as e:
+        volume.close()
+        print(f"{parser.prog} {args.command}: {e}", file=sys.stderr)
+        return 1
+    volume.close(save=args.command in WRITING)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,375 @@
+"""
+Online defragmentation of the block store
+- fragmentation: Fragmentation figures of a FAT
+- Defragmenter: Incremental compaction of file chains
+
+The defragmenter packs files one after another from block 0, so every
+chain becomes a single run and the free space ends up as one run at the
+end of the disk. It works in steps of bounded duration that leave the
+FAT, disk and catalog consistent, so the caller can run it between other
+work; planning is split into the same steps, and changes published by the
+catalog meanwhile update only the files concerned.
+"""
+import time
+from array import array
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Set
+
+from events import NodeDeleted, NodeMoved, NodeRenamed
+from File import Catalog, CatalogNode, Disk, FAT
+
+# Longest pause of a step, in seconds
+STEP_BUDGET = 0.01
+
+# Blocks followed or scanned between checks of the step deadline
+SCAN_CHUNK = 1 << 12
+
+
+def fragmentation(fat: FAT, starts: Iterable[int]) -> Dict[str, Any]:
+    """
+    Describe how fragmented the files starting at starts and the free space are
+    """
+    return _figures([len(fat.extents(start)) for start in starts if start != -1], fat.free_space())
+
+
+def _figures(extents: Sequence[int], free_space: Dict[str, Any]) -> Dict[str, Any]:
+    # Fragmentation figures from the extent count of each file and FAT.free_space()
+    figures = {
+        'files': len(extents),
+        'fragmented_files': sum(1 for count in extents if count > 1),
+        'avg_extents_per_file': sum(extents) / len(extents) if extents else 0.0,
+        'max_extents_per_file': max(extents, default=0),
+    }
+    figures.update(free_space)
+    return figures
+
+
+class Defragmenter:
+    """
+    Relocates blocks so each file's chain is contiguous and free space is consolidated
+
+    Files are taken in the order of their first block and laid out from a
+    cursor that starts at block 0. A block of another file in the way is
+    moved to a free block past the file being placed, so at least one free
+    block is needed. Used blocks no file of the catalog owns, such as a
+    leaked chain, are left where they are and the files are laid out around
+    them. The catalog is loaded completely when planning.
+
+    Planning, and counting the figures at the end, run as generators that
+    steps advance until their deadline. A file written or created while
+    blocks are moved is followed again and queued; if blocks freed below
+    the cursor leave holes, a new pass is planned once the queue is empty.
+    The figures before are known once the first plan is complete.
+    """
+    def __init__(self, catalog: Catalog, fat: FAT, disk: Disk):
+        self.catalog = catalog
+        self.fat = fat
+        self.disk = disk
+        self.before: Optional[Dict[str, Any]] = None
+        self.after: Optional[Dict[str, Any]] = None
+        self.moved = 0
+        # Stopped early because the disk has no free block
+        self.incomplete = False
+        self.stale = True
+        self.planning: Optional[Iterator[None]] = None
+        self.counting: Optional[Iterator[None]] = None
+        self.used = 0
+        self.placed = 0
+        catalog.events.subscribe(self._changed)
+
+    def _changed(self, event) -> None:
+        if isinstance(event, NodeRenamed):
+            return
+        if self.stale or self.planning is not None:
+            # Plan again from the current layout
+            self.stale = True
+            return
+        if isinstance(event, NodeMoved):
+            return
+        self.counting = None
+        if isinstance(event, NodeDeleted):
+            if self.current is not None and self.current.catalog is None:
+                self._rewind()
+            return
+        node = self.catalog.get(event.node_id)
+        if node is None:
+            return
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.is_file:
+                self._update(node)
+            else:
+                stack.extend(node.children)
+
+    def close(self) -> None:
+        """
+        Stop following catalog changes
+        """
+        self.catalog.events.unsubscribe(self._changed)
+
+    def _follow(self, node: CatalogNode) -> Iterator[None]:
+        """
+        Record the predecessor and owner of each block of node's chain,
+        yielding now and then; returns the number of extents
+        """
+        prev, owner, fat = self.prev, self.owner, self.fat.fat
+        previous = -1
+        length = 0
+        extents = 0
+        index = node.data.start
+        while index != -1:
+            prev[index] = previous
+            owner[index] = node
+            if previous == -1 or index != previous + 1:
+                extents += 1
+            previous = index
+            index = fat[index]
+            length += 1
+            if not length % SCAN_CHUNK:
+                yield
+        self.used += length - self.lengths.get(node.id, 0)
+        self.lengths[node.id] = length
+        return extents
+
+    def _plan(self) -> Iterator[None]:
+        """
+        Find the files, follow their chains and queue them by first block
+        """
+        block_num = self.fat.block_num
+        # Predecessor of each used block in its chain (-1 at the start) and the file it belongs to
+        self.prev = array('i', [-1]) * block_num
+        self.owner: List[Optional[CatalogNode]] = [None] * block_num
+        self.files: Dict[int, CatalogNode] = {}
+        self.lengths: Dict[int, int] = {}
+        self.used = 0
+        self.placed = 0
+
+        stack = [self.catalog.root]
+        while stack:
+            for child in stack.pop().children:
+                if not child.is_file:
+                    stack.append(child)
+                elif child.data.start != -1:
+                    self.files[child.id] = child
+            yield
+
+        # First blocks of the files, to queue them in block order without sorting
+        first = bytearray(block_num)
+        extents = []
+        for node in self.files.values():
+            first[node.data.start] = 1
+            extents.append((yield from self._follow(node)))
+            yield
+
+        queue: Deque[CatalogNode] = deque()
+        for low in range(0, block_num, SCAN_CHUNK):
+            high = min(low + SCAN_CHUNK, block_num)
+            index = first.find(1, low, high)
+            while index != -1:
+                queue.append(self.owner[index])
+                index = first.find(1, index + 1, high)
+            yield
+        if self.before is None:
+            runs = yield from self._free_runs()
+            self.before = _figures(extents, self.fat.free_space(runs))
+
+        self.queue = queue
+        self.queued: Set[int] = set(self.files)
+        self.cursor = 0
+        # Next block of the file being placed, -1 between files
+        self.block = -1
+        self.remaining = 0
+        # File being placed, the cursor where it began and its blocks in place
+        self.current: Optional[CatalogNode] = None
+        self.current_cursor = 0
+        self.current_placed = 0
+
+    def _update(self, node: CatalogNode) -> None:
+        """
+        Follow the new chain of a file written or created since planning and queue it
+        """
+        if node is self.current:
+            self._rewind()
+        elif node.id not in self.queued:
+            # Placed before, or new
+            self.placed -= self.lengths.get(node.id, 0)
+        if node.data.start == -1:
+            self.used -= self.lengths.pop(node.id, 0)
+            self.files.pop(node.id, None)
+            return
+        for _ in self._follow(node):
+            pass
+        self.files[node.id] = node
+        if node.id not in self.queued:
+            self.queue.append(node)
+            self.queued.add(node.id)
+
+    def _rewind(self) -> None:
+        """
+        Take back the file being placed, which changed, to place it again from where it began
+        """
+        node = self.current
+        self.current = None
+        self.block = -1
+        self.cursor = self.current_cursor
+        self.placed -= self.current_placed
+        if node.catalog is None:
+            self.used -= self.lengths.pop(node.id, 0)
+            self.files.pop(node.id, None)
+        else:
+            self.queue.appendleft(node)
+            self.queued.add(node.id)
+
+    def _free_runs(self) -> Iterator[None]:
+        """
+        Scan the free map a part at a time; returns the lengths of its free runs
+        """
+        free_map = self.fat.free_map
+        block_num = self.fat.block_num
+        runs = []
+        # Start of the run crossing into the next part
+        run = -1
+        for low in range(0, block_num, SCAN_CHUNK):
+            high = min(low + SCAN_CHUNK, block_num)
+            pos = low
+            while True:
+                if run == -1:
+                    pos = free_map.find(1, pos, high)
+                    if pos == -1:
+                        break
+                    run = pos
+                stop = free_map.find(0, pos, high)
+                if stop == -1:
+                    break
+                runs.append(stop - run)
+                run = -1
+                pos = stop
+            yield
+        if run != -1:
+            runs.append(block_num - run)
+        return runs
+
+    def _count(self) -> Iterator[None]:
+        """
+        Work out the figures after defragmenting
+        """
+        extents = []
+        for node in list(self.files.values()):
+            if node.catalog is not None and node.data.start != -1:
+                extents.append(len(self.fat.extents(node.data.start)))
+                yield
+        runs = yield from self._free_runs()
+        self.after = _figures(extents, self.fat.free_space(runs))
+
+    @staticmethod
+    def _advance(work: Iterator[None], deadline: float) -> bool:
+        # Run work until it is done, returning True, or until the deadline
+        for _ in work:
+            if time.perf_counter() >= deadline:
+                return False
+        return True
+
+    @property
+    def progress(self) -> float:
+        """
+        Share of the used blocks already in place
+        """
+        if self.stale or self.planning is not None or not self.used:
+            return 0.0
+        return self.placed / self.used
+
+    def _move(self, src: int, dst: int) -> None:
+        prev = self.prev[src]
+        node = self.owner[src]
+        following = self.fat.fat[src]
+        self.fat.relocate(src, dst, prev, self.disk)
+        self.prev[dst] = prev
+        self.owner[dst] = node
+        self.owner[src] = None
+        if following != -1:
+            self.prev[following] = dst
+        if prev == -1:
+            node.data.start = dst
+            node.touch()
+        node.data.extents = None
+        self.moved += 1
+
+    def step(self, budget: float = STEP_BUDGET) -> bool:
+        """
+        Relocate blocks for about budget seconds
+        Returns True once the disk is defragmented
+        """
+        deadline = time.perf_counter() + budget
+        if self.stale:
+            self.stale = False
+            self.counting = None
+            self.planning = self._plan()
+        if self.planning is not None:
+            if not self._advance(self.planning, deadline):
+                return False
+            self.planning = None
+        if self.counting is not None:
+            return self._finish(deadline)
+
+        free_map = self.fat.free_map
+        while time.perf_counter() < deadline:
+            if self.block == -1:
+                if not self.queue:
+                    if free_map.find(1, 0, self.cursor) != -1:
+                        # Blocks freed below the cursor, pack again from block 0
+                        self.stale = True
+                        return False
+                    self.counting = self._count()
+                    return self._finish(deadline)
+                node = self.queue.popleft()
+                self.queued.discard(node.id)
+                if node.catalog is None or node.data.start == -1:
+                    # Removed or emptied meanwhile
+                    self.used -= self.lengths.pop(node.id, 0)
+                    self.files.pop(node.id, None)
+                    continue
+                self.current = node
+                self.current_cursor = self.cursor
+                self.current_placed = 0
+                self.block = node.data.start
+                self.remaining = self.lengths[node.id]
+            target = self.cursor
+            if self.block != target:
+                if not free_map[target] and self.owner[target] is None:
+                    # Not part of any file, leave it in place
+                    self.cursor += 1
+                    continue
+                if not free_map[target]:
+                    # Make room, preferably past the blocks of this file
+                    spare = free_map.find(1, target + self.remaining)
+                    if spare == -1:
+                        spare = free_map.find(1, target + 1)
+                    if spare == -1:
+                        self.incomplete = True
+                        self.counting = self._count()
+                        return self._finish(deadline)
+                    self._move(target, spare)
+                self._move(self.block, target)
+            self.block = self.fat.fat[target]
+            self.cursor += 1
+            self.placed += 1
+            self.current_placed += 1
+            self.remaining -= 1
+            if self.block == -1:
+                self.current = None
+        return False
+
+    def _finish(self, deadline: float) -> bool:
+        if not self._advance(self.counting, deadline):
+            return False
+        self.counting = None
+        return True
+
+    def run(self) -> Dict[str, Any]:
+        """
+        Defragment in one go and return the figures afterwards
+        """
+        while not self.step():
+            pass
+        return self.after
@@ -0,0 +1,67 @@
+"""
+Change notifications of the catalog
+- NodeCreated, NodeRenamed, NodeDeleted, ContentUpdated, NodeMoved: Event types
+- EventBus: Synchronous publish/subscribe dispatcher
+
+Events carry node IDs rather than nodes, so subscribers look up what
+they need and never keep removed nodes alive.
+"""
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Type
+
+
+class NodeCreated(NamedTuple):
+    node_id: int
+    parent_id: int
+
+
+class NodeRenamed(NamedTuple):
+    node_id: int
+    old_name: str
+    new_name: str
+
+
+class NodeDeleted(NamedTuple):
+    """
+    A node was removed together with everything below it
+    """
+    node_id: int
+    parent_id: int
+
+
+class ContentUpdated(NamedTuple):
+    node_id: int
+
+
+class NodeMoved(NamedTuple):
+    node_id: int
+    old_parent_id: int
+    new_parent_id: int
+
+
+Handler = Callable[[Any], None]
+
+
+class EventBus:
+    """
+    Calls the handlers subscribed to an event type, in subscription order,
+    when an event of that type is published
+    """
+    def __init__(self):
+        self.handlers: Dict[Optional[Type], List[Handler]] = {}
+
+    def subscribe(self, handler: Handler, event_type: Optional[Type] = None) -> None:
+        """
+        Call handler for every event of event_type, or for every event if None
+        """
+        self.handlers.setdefault(event_type, []).append(handler)
+
+    def unsubscribe(self, handler: Handler, event_type: Optional[Type] = None) -> None:
+        handlers = self.handlers.get(event_type)
+        if handlers and handler in handlers:
+            handlers.remove(handler)
+
+    def publish(self, event: Any) -> None:
+        for handler in self.handlers.get(type(event), ()):
+            handler(event)
+        for handler in self.handlers.get(None, ()):
+            handler(event)
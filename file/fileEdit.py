@@ -1,25 +1,33 @@
 """
 File editing dialogs for the file management system
 """
+import json
 import sys
-from typing import Optional, Callable
+from typing import Any, Dict, Optional, Callable
 from PyQt5.QtWidgets import (
     QWidget, QTextEdit, QHBoxLayout, QVBoxLayout, QMessageBox,
-    QLabel, QGridLayout
+    QLabel, QGridLayout, QTreeWidget, QTreeWidgetItem, QPushButton,
+    QFileDialog
 )
 from PyQt5.QtGui import QIcon, QPixmap, QFont
 from PyQt5.QtCore import pyqtSignal, Qt
 import time
 
+from File import ENCODING
+
 
 class EditForm(QWidget):
     """
     Dialog for editing file contents
+
+    The file content is passed in and emitted back as encoded bytes.
+    Content that is not valid text is shown read-only so saving cannot
+    corrupt it.
     """
     # Signal to notify parent about content changes
-    _signal = pyqtSignal(str)
+    _signal = pyqtSignal(bytes)
 
-    def __init__(self, name: str, data: str):
+    def __init__(self, name: str, data: bytes):
         super().__init__()
         
         # Window setup
@@ -29,12 +37,21 @@ class EditForm(QWidget):
         self.setWindowIcon(QIcon('img/file.png'))
         self.resize(412, 412)
         
+        # Decode file content
+        try:
+            text = data.decode(ENCODING)
+            is_text = True
+        except UnicodeDecodeError:
+            text = data.decode(ENCODING, errors='replace')
+            is_text = False
+
         # Text editor setup
         self.text_edit = QTextEdit(self)
-        self.text_edit.setText(data)
+        self.text_edit.setPlainText(text)
         self.text_edit.setPlaceholderText("Enter file content here")
+        self.text_edit.setReadOnly(not is_text)
         self.text_edit.textChanged.connect(self.change_message)
-        self.initial_data = data
+        self.initial_data = self.text_edit.toPlainText()
 
         # Layout setup
         self.h_layout = QHBoxLayout()
@@ -74,7 +91,7 @@ class EditForm(QWidget):
         if reply.clickedButton() == button_ignore:
             event.ignore()
         elif reply.clickedButton() == button_yes:
-            self._signal.emit(self.text_edit.toPlainText())
+            self._signal.emit(self.text_edit.toPlainText().encode(ENCODING))
             event.accept()
         else:
             event.accept()
@@ -156,3 +173,73 @@ class AttributeForm(QWidget):
         
         return f'{year}-{month}-{day} {hour}:{minute}:{second}'
 
+
+class StatisticsForm(QWidget):
+    """
+    Dialog showing volume statistics as a tree, with refresh and JSON export
+
+    collect returns the statistics as nested dictionaries and is called
+    again on every refresh.
+    """
+    def __init__(self, collect: Callable[[], Dict[str, Any]]):
+        super().__init__()
+        self.collect = collect
+        self.stats: Dict[str, Any] = {}
+
+        # Window setup
+        self.setWindowTitle('Statistics')
+        self.setWindowIcon(QIcon('img/attribute.png'))
+        self.resize(480, 560)
+
+        # Statistics tree
+        self.tree = QTreeWidget(self)
+        self.tree.setHeaderLabels(['Name', 'Value'])
+        self.tree.setColumnWidth(0, 240)
+
+        # Buttons
+        refresh_button = QPushButton('Refresh', self)
+        refresh_button.clicked.connect(self.refresh)
+        export_button = QPushButton('Export JSON...', self)
+        export_button.clicked.connect(self.export)
+
+        buttons = QHBoxLayout()
+        buttons.addStretch()
+        buttons.addWidget(refresh_button)
+        buttons.addWidget(export_button)
+        layout = QVBoxLayout()
+        layout.addWidget(self.tree)
+        layout.addLayout(buttons)
+        self.setLayout(layout)
+
+        self.setWindowModality(Qt.ApplicationModal)
+        self.refresh()
+
+    def refresh(self):
+        """
+        Collect the statistics again and show them
+        """
+        self.stats = self.collect()
+        self.tree.clear()
+        self._add_items(self.tree.invisibleRootItem(), self.stats)
+        self.tree.expandAll()
+
+    def _add_items(self, parent: QTreeWidgetItem, values: Dict[str, Any]):
+        for key, value in values.items():
+            item = QTreeWidgetItem(parent, [key.replace('_', ' ')])
+            if isinstance(value, dict):
+                self._add_items(item, value)
+            elif isinstance(value, float):
+                item.setText(1, f'{value:.4g}')
+            else:
+                item.setText(1, str(value))
+
+    def export(self):
+        """
+        Save the statistics shown to a JSON file
+        """
+        path, _ = QFileDialog.getSaveFileName(self, 'Export Statistics', 'statistics.json',
+                                              'JSON files (*.json)')
+        if not path:
+            return
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.stats, f, indent=2)
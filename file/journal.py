@@ -0,0 +1,228 @@
+"""
+Write-ahead journal for the file system
+- Journal: Sequential log of block, FAT and catalog changes with group commit
+
+Every save appends one transaction (the changed blocks, the changed FAT
+entries, the catalog nodes added, changed or removed, then a commit
+record) instead of rewriting the disk image, FAT and catalog files. A background thread writes
+queued transactions and syncs them together, so several saves in quick
+succession cost a single fsync. On startup committed transactions are
+replayed and a checkpoint copies the state into the main files, after which
+the journal is emptied. A torn transaction at the end of the journal, left
+by a crash while writing it, has no commit record; it is ignored and cut off
+before anything new is appended.
+"""
+import os
+import struct
+import threading
+import zlib
+from typing import Any, List, Optional, Sequence, Tuple
+
+from File import Block, Catalog, FAT
+
+JOURNAL_MAGIC = b'FSJRNL01'
+
+# Checkpoint once the journal grows past this size
+CHECKPOINT_SIZE = 4 * 1024 * 1024
+
+# Record framing: type, payload length, CRC32 of the payload
+RECORD_HEADER = struct.Struct('<BII')
+RECORD_BLOCK = 1
+RECORD_FAT = 2
+RECORD_COMMIT = 4
+# Catalog node added or changed, encoded by Catalog.node_change
+RECORD_NODE = 5
+# IDs of removed catalog nodes
+RECORD_REMOVED = 6
+
+BLOCK_HEADER = struct.Struct('<I')
+FAT_COUNT = struct.Struct('<I')
+FAT_ENTRY = struct.Struct('<ii')
+NODE_ID = struct.Struct('<I')
+COMMIT = struct.Struct('<Q')
+
+
+def _record(kind: int, payload: bytes) -> bytes:
+    return RECORD_HEADER.pack(kind, len(payload), zlib.crc32(payload)) + payload
+
+
+class Journal:
+    """
+    Append-only journal file with a background group-commit writer
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, 'a+b')
+        self.file.seek(0, os.SEEK_END)
+        if self.file.tell() == 0:
+            self.file.write(JOURNAL_MAGIC)
+            self.file.flush()
+        self.size = self.file.tell()
+
+        self.sequence = 0
+        self.durable = 0
+        self.queue: List[Tuple[int, bytes]] = []
+        self.error: Optional[BaseException] = None
+        self.closing = False
+        self.condition = threading.Condition()
+        self.writer = threading.Thread(target=self._write_loop, name='journal-writer', daemon=True)
+        self.writer.start()
+
+    def replay(self, fat: FAT, disk: Sequence[Block], catalog: Catalog) -> Tuple[int, bool]:
+        """
+        Apply the committed transactions in the journal to fat, disk and catalog
+        Returns the number of transactions applied and whether the catalog changed
+        """
+        self.sync()
+        self.file.seek(0)
+        raw = self.file.read()
+        self.file.seek(0, os.SEEK_END)
+        if raw[:len(JOURNAL_MAGIC)] != JOURNAL_MAGIC:
+            if JOURNAL_MAGIC.startswith(raw):
+                # Torn while the journal was being created
+                self.file.truncate(0)
+                self.file.write(JOURNAL_MAGIC)
+                self.file.flush()
+                os.fsync(self.file.fileno())
+                self.size = len(JOURNAL_MAGIC)
+            return 0, False
+
+        applied = 0
+        catalog_changed = False
+        transaction: List[Tuple[int, bytes]] = []
+        pos = len(JOURNAL_MAGIC)
+        # Just past the last commit record
+        end = pos
+        while pos + RECORD_HEADER.size <= len(raw):
+            kind, length, crc = RECORD_HEADER.unpack_from(raw, pos)
+            pos += RECORD_HEADER.size
+            payload = raw[pos:pos + length]
+            if len(payload) != length or zlib.crc32(payload) != crc:
+                # Torn write at the end of the journal
+                break
+            pos += length
+            if kind != RECORD_COMMIT:
+                transaction.append((kind, payload))
+                continue
+
+            changes = []
+            removed = []
+            for kind, payload in transaction:
+                if kind == RECORD_BLOCK:
+                    index, = BLOCK_HEADER.unpack_from(payload, 0)
+                    disk[index].write(memoryview(payload)[BLOCK_HEADER.size:])
+                elif kind == RECORD_FAT:
+                    count, = FAT_COUNT.unpack_from(payload, 0)
+                    for i in range(count):
+                        index, value = FAT_ENTRY.unpack_from(payload, FAT_COUNT.size + i * FAT_ENTRY.size)
+                        fat.set_next(index, value)
+                elif kind == RECORD_NODE:
+                    changes.append(payload)
+                elif kind == RECORD_REMOVED:
+                    removed.extend(node_id for node_id, in NODE_ID.iter_unpack(payload))
+            if changes or removed:
+                catalog.apply_changes(changes, removed)
+                catalog_changed = True
+            transaction = []
+            applied += 1
+            end = pos
+
+        if end < len(raw):
+            # Cut off the torn or uncommitted tail, so later transactions
+            # are appended right after the last committed one
+            self.file.truncate(end)
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.size = end
+        if applied:
+            fat.rebuild_free_map()
+        self.sequence = self.durable = applied
+        return applied, catalog_changed
+
+    def commit(self, fat: FAT, disk: Any, catalog: Optional[Catalog] = None) -> int:
+        """
+        Queue a transaction with the changes since the last commit and return its number
+
+        The changes are collected right away; writing and syncing happen on the
+        writer thread, use sync() to wait until the transaction is durable.
+        """
+        records = []
+        for index, data in disk.take_changes():
+            records.append(_record(RECORD_BLOCK, BLOCK_HEADER.pack(index) + data))
+        entries = fat.take_changes()
+        if entries:
+            payload = FAT_COUNT.pack(len(entries)) + b"".join(FAT_ENTRY.pack(i, v) for i, v in entries)
+            records.append(_record(RECORD_FAT, payload))
+        if catalog is not None:
+            nodes, removed = catalog.take_changes()
+            for node, appended in nodes:
+                records.append(_record(RECORD_NODE, catalog.node_change(node, appended)))
+            if removed:
+                records.append(_record(RECORD_REMOVED, b"".join(NODE_ID.pack(i) for i in removed)))
+
+        with self.condition:
+            if self.error is not None:
+                raise self.error
+            self.sequence += 1
+            records.append(_record(RECORD_COMMIT, COMMIT.pack(self.sequence)))
+            data = b"".join(records)
+            self.queue.append((self.sequence, data))
+            self.size += len(data)
+            self.condition.notify_all()
+            return self.sequence
+
+    def _write_loop(self) -> None:
+        while True:
+            with self.condition:
+                while not self.queue and not self.closing:
+                    self.condition.wait()
+                if not self.queue:
+                    return
+                batch = self.queue
+                self.queue = []
+            try:
+                # One write and one sync for every transaction queued meanwhile
+                self.file.write(b"".join(data for _, data in batch))
+                self.file.flush()
+                os.fsync(self.file.fileno())
+            except BaseException as e:
+                with self.condition:
+                    self.error = e
+                    self.condition.notify_all()
+                return
+            with self.condition:
+                self.durable = batch[-1][0]
+                self.condition.notify_all()
+
+    def sync(self) -> None:
+        """
+        Wait until every committed transaction is on disk
+        """
+        with self.condition:
+            while self.durable < self.sequence and self.error is None:
+                self.condition.wait()
+            if self.error is not None:
+                raise self.error
+
+    def needs_checkpoint(self) -> bool:
+        return self.size > CHECKPOINT_SIZE
+
+    def reset(self) -> None:
+        """
+        Empty the journal once its changes are in the main files
+        """
+        self.sync()
+        self.file.truncate(len(JOURNAL_MAGIC))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.size = len(JOURNAL_MAGIC)
+
+    def close(self) -> None:
+        """
+        Write out queued transactions and close the journal
+        """
+        with self.condition:
+            self.closing = True
+            self.condition.notify_all()
+        self.writer.join()
+        self.file.close()
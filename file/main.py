@@ -2,25 +2,30 @@
 Main application for the file management system
 """
 import sys
-import os
-import pickle
 import time
 from typing import List, Optional, Dict, Any, Tuple
 
 from PyQt5.QtWidgets import (
     QMainWindow, QApplication, QWidget, QDesktopWidget, QGridLayout, 
-    QAction, QLineEdit, QFormLayout, QTreeWidget, QTreeWidgetItem, 
+    QAction, QLineEdit, QFormLayout, QTreeView, 
     QListView, QAbstractItemView, QMessageBox, QMenu, QShortcut,
-    QListWidgetItem, QSplitter
+    QSplitter, QInputDialog
 )
 from PyQt5.QtGui import QIcon, QStandardItem, QStandardItemModel, QKeySequence, QPalette, QColor, QFont
 from PyQt5.QtCore import QSize, Qt, QModelIndex, QTimer
 
-from File import CatalogNode, FAT, Block, BLOCK_NUM
+from allocator import ALLOCATORS
+from defrag import Defragmenter
+from File import Catalog, CatalogNode, FAT, Disk
+from models import CatalogListModel, CatalogTreeModel
 from MyWidget import MyListWidget
-from fileEdit import EditForm, AttributeForm
+from volume import Volume
+from fileEdit import EditForm, AttributeForm, StatisticsForm
 
 
+# Largest volume offered when formatting, in blocks
+MAX_BLOCKS = 1 << 24
+
 # 定义应用程序样式
 APP_STYLE = """
 QMainWindow {
@@ -61,19 +66,19 @@ QLineEdit {
     selection-background-color: #3498db;
 }
 
-QTreeWidget {
+QTreeView {
     background-color: #ecf0f1;
     border: 1px solid #bdc3c7;
     border-radius: 4px;
     padding: 4px;
 }
 
-QTreeWidget::item {
+QTreeView::item {
     padding: 6px;
     margin: 2px 0;
 }
 
-QTreeWidget::item:selected {
+QTreeView::item:selected {
     background-color: #3498db;
     color: white;
     border-radius: 4px;
@@ -142,14 +147,14 @@ class MainForm(QMainWindow):
     """
     Main window for the file management system
     """
-    def __init__(self):
+    def __init__(self, volume: Optional[Volume] = None):
         super().__init__()
 
         # Load file data
-        self.read_file()
+        self.volume = volume or Volume('.')
 
         # Set up root directory
-        self.cur_node = self.catalog[0]
+        self.cur_node = self.catalog.root
         self.root_node = self.cur_node
         self.base_url = ['root']
 
@@ -202,10 +207,17 @@ class MainForm(QMainWindow):
 
         # Update UI
         self.update_print()
-        self.last_loc = -1
+        # Keep the item count and free space in the status bar current
+        self.catalog.events.subscribe(lambda event: self.update_print())
+        self.last_name = None
 
         # Set up keyboard shortcuts
         QShortcut(QKeySequence(self.tr("Delete")), self, self.delete_file)
+
+        # Background defragmentation, run in short steps between UI events
+        self.defragmenter = None
+        self.defrag_timer = QTimer(self)
+        self.defrag_timer.timeout.connect(self.defragment_step)
     
     def setup_menu_bar(self):
         """
@@ -233,6 +245,13 @@ class MainForm(QMainWindow):
         new_folder_action.triggered.connect(self.create_folder)
         file_menu.addAction(new_folder_action)
         
+        file_menu.addSeparator()
+
+        save_action = QAction('Save', self)
+        save_action.setShortcut('Ctrl+S')
+        save_action.triggered.connect(self.save_file)
+        file_menu.addAction(save_action)
+
         file_menu.addSeparator()
         file_menu.addAction(exit_action)
         
@@ -273,6 +292,16 @@ class MainForm(QMainWindow):
         format_action = QAction('Format Disk', self)
         format_action.triggered.connect(self.format)
         tools_menu.addAction(format_action)
+
+        # Add statistics action to tools menu
+        stats_action = QAction('Statistics', self)
+        stats_action.triggered.connect(self.show_statistics)
+        tools_menu.addAction(stats_action)
+
+        # Add defragment action to tools menu
+        defrag_action = QAction('Defragment Disk', self)
+        defrag_action.triggered.connect(self.defragment)
+        tools_menu.addAction(defrag_action)
         
         # Help action
         menubar.addAction('Help', self.introduction)
@@ -345,39 +374,50 @@ class MainForm(QMainWindow):
         """
         Navigate back to root directory
         """
+        self.list_view.close_edit()
+
         # If already at root, do nothing
         if self.cur_node == self.root_node:
             return
-        
-        # Return to root directory
-        while self.back_event():
-            pass
+
+        # Jump straight to the root; forward goes back into the top folder left
+        self.last_name = self.catalog.key_of(self.cur_node)[0]
+        self.forward_action.setEnabled(True)
+
+        self.cur_node = self.root_node
+        self.update_loc()
+        self.base_url = ['root']
+        self.select_tree_node()
+        self.update_print()
+        self.back_action.setEnabled(False)
     
     def setup_file_tree(self):
         """
         Set up the file tree view
         """
-        self.tree = QTreeWidget()
-        self.tree.setColumnCount(1)
-        self.tree.setHeaderLabels(['Folders'])
+        self.tree = QTreeView()
+        self.tree_model = CatalogTreeModel(self.catalog, self)
+        self.tree.setModel(self.tree_model)
+        self.tree.setUniformRowHeights(True)
         self.tree.setMinimumWidth(250)  # Set minimum width
         self.tree.setFont(QFont("Arial", 10))
         
-        # Build tree
-        self.build_tree()
+        # Folders are filled in by the model as they are expanded
+        root_index = self.tree_model.index_of(self.root_node)
+        self.tree.expand(root_index)
         
         # Set selection
-        self.tree.setCurrentItem(self.root_item)
-        self.tree_item = [self.root_item]
+        self.tree.setCurrentIndex(root_index)
         
         # Connect click event
-        self.tree.itemClicked['QTreeWidgetItem*', 'int'].connect(self.click_tree_item)
+        self.tree.clicked.connect(self.click_tree_item)
     
     def setup_file_list_view(self):
         """
         Set up the file list view
         """
-        self.list_view = MyListWidget(self.cur_node, parents=self)
+        self.list_model = CatalogListModel(self.catalog, self)
+        self.list_view = MyListWidget(self.list_model, parents=self)
         self.list_view.setMinimumWidth(800)
         self.list_view.setViewMode(QListView.IconMode)
         self.list_view.setIconSize(QSize(72, 72))
@@ -410,96 +450,65 @@ class MainForm(QMainWindow):
         'Create new: Right-click to create new files or folders\n'+
         'Rename: Right-click to rename files or folders\n'+
         'Format: Clear all content\n'+
+        'Statistics: Free space, fragmentation and operation timings, exportable as JSON\n'+
+        'Defragment: Make every file contiguous while you keep working\n'+
         'Navigation bar: View current path\n'+
         'Back/Forward: Return to parent directory or navigate to previously visited locations\n'+
         '-----------------------------------------\n')
 
-    def click_tree_item(self, item, column):
-        ways = [item]
-        #查看所在层数
-        level = 0
-        temp = item
-        
-        while temp.parent() != None:
-            temp = temp.parent()
-            ways.append(temp)
-            level += 1
- 
-        ways.reverse()
-        #回退到根节点
-        while self.back_event():
-            pass
-        self.base_url = self.base_url[:1]
-        self.tree_item = self.tree_item[:1]
-
-        #一步一步前进
-        for i in ways:
-            if i == self.root_item:
-                continue
-            #前往该路径
-            #从curNode中查询item
-            new_node = None
-            for j in self.cur_node.children:
-                if j.name == i.text(0):
-                    new_node = j
-                    break
-            #前往路径j
-            if new_node.is_file:
-                #文件的话，break即可
-                break
-            else:
-                self.cur_node = new_node
-                self.update_loc()
-                self.base_url.append(new_node.name)
-
-                #更新路径
-                for j in range(self.tree_item[-1].childCount()):
-                    if self.tree_item[-1].child(j).text(0) == new_node.name:
-                        selected_item = self.tree_item[-1].child(j)
-                self.tree_item.append(selected_item)
-                self.tree.setCurrentItem(selected_item)
+    def click_tree_item(self, index: QModelIndex):
+        """
+        Jump straight to the folder clicked in the tree, or to the folder holding a clicked file
+        """
+        self.list_view.close_edit()
+
+        node = self.tree_model.node(index)
+        if node is None:
+            return
+        if node.is_file:
+            #文件的话，停在所在文件夹
+            node = node.parent
+
+        self.cur_node = node
+        self.update_loc()
+        self.base_url = ['root'] + list(self.catalog.key_of(node))
+        self.select_tree_node()
         
         #更新下标
         self.update_print()
         
-        if self.cur_node != self.root_node:
-            self.back_action.setEnabled(True)
-        
+        self.back_action.setEnabled(self.cur_node != self.root_node)
         self.forward_action.setEnabled(False)
-        self.last_loc = -1
+        self.last_name = None
 
     def update_loc(self):
         self.load_cur_file()
-        self.list_view.cur_node = self.cur_node
 
     #打开文件
     def open_file(self, modelindex: QModelIndex) -> None:
         #获取点击item
         self.list_view.close_edit()
 
-        try:
-            item = self.list_view.item(modelindex.row())
-        except:
-            #报错，则说明是右键打开方式
-            if len(self.list_view.selectedItems()) == 0:
-                return
-            item = self.list_view.selectedItems()[-1]
+        if isinstance(modelindex, QModelIndex) and modelindex.isValid():
+            new_node = self.list_model.node(modelindex)
+        elif self.list_view.selectedIndexes():
+            #右键打开方式
+            new_node = self.list_model.node(self.list_view.selectedIndexes()[-1])
+        else:
+            new_node = None
 
         #如果可以前进
-        if self.last_loc != -1 and self.next_step:
-            item = self.list_view.item(self.last_loc)
-            self.last_loc = -1
+        if self.last_name is not None and self.next_step:
+            new_node = self.cur_node.get_child(self.last_name)
+            self.last_name = None
             self.forward_action.setEnabled(False)
         self.next_step = False
 
-        new_node = None
-        for i in self.cur_node.children:
-            if i.name == item.text():
-                new_node = i
-                break
+        if new_node is None:
+            return
 
         if new_node.is_file:
-            data = new_node.data.read(self.fat, self.disk)
+            data = new_node.data.read_bytes(self.fat, self.disk)
             self.child = EditForm(new_node.name, data)
             self.child._signal.connect(self.getData)
             self.child.show()
@@ -513,11 +522,7 @@ class MainForm(QMainWindow):
             self.base_url.append(new_node.name)
 
             #更新路径
-            for i in range(self.tree_item[-1].childCount()):
-                if self.tree_item[-1].child(i).text(0) == new_node.name:
-                    selected_item = self.tree_item[-1].child(i)
-            self.tree_item.append(selected_item)
-            self.tree.setCurrentItem(selected_item)
+            self.select_tree_node()
             self.back_action.setEnabled(True)
 
             self.update_print()
@@ -527,7 +532,8 @@ class MainForm(QMainWindow):
         Update status bar and location display
         """
         # Create a colorful status bar message
-        status_message = f"{len(self.cur_node.children)} items | File Management System"
+        status_message = (f"{self.cur_node.child_count} items | "
+                          f"{self.fat.free_count} of {len(self.disk)} blocks free | File Management System")
         self.statusBar().showMessage(status_message)
         
         # Update path display with modern formatting
@@ -543,7 +549,7 @@ class MainForm(QMainWindow):
         """
         Rename the selected file or folder
         """
-        if len(self.list_view.selectedItems()) == 0:
+        if not self.list_view.selectedIndexes():
             return
         
         # 关闭之前的编辑状态
@@ -562,21 +568,20 @@ class MainForm(QMainWindow):
         """
         Delete file or folder
         """
-        if len(self.list_view.selectedItems()) == 0:
+        if not self.list_view.selectedIndexes():
             return
 
-        item = self.list_view.selectedItems()[-1]
-        index = self.list_view.selectedIndexes()[-1].row()
+        node = self.list_model.node(self.list_view.selectedIndexes()[-1])
 
         # Confirmation dialog
         reply = QMessageBox()
         reply.setWindowTitle('Confirm')
         
         # Different message based on file type
-        if self.cur_node.children[index].is_file:
-            reply.setText(f'Are you sure you want to delete the file "{item.text()}"?')
+        if node.is_file:
+            reply.setText(f'Are you sure you want to delete the file "{node.name}"?')
         else:
-            reply.setText(f'Are you sure you want to delete the folder "{item.text()}" and all its contents?')
+            reply.setText(f'Are you sure you want to delete the folder "{node.name}" and all its contents?')
             
         reply.setStandardButtons(QMessageBox.Yes | QMessageBox.No)
         buttonY = reply.button(QMessageBox.Yes)
@@ -589,34 +594,8 @@ class MainForm(QMainWindow):
         if reply.clickedButton() == buttonN:
             return
         
-        # Delete file
-        self.list_view.takeItem(index)
-        del item
-        # Delete from FAT table
-        self.delete_file_recursive(self.cur_node.children[index])
-        self.cur_node.children.remove(self.cur_node.children[index])
-        # Update catalog
-        self.catalog = self.update_catalog(self.root_node)
-
-        # Update UI
-        self.update_tree()
-
-    def delete_file_recursive(self, node):
-        if node.is_file:
-            node.data.delete(self.fat, self.disk)
-        else:
-            for i in node.children:
-                self.delete_file_recursive(i)
-   
-
-    def update_catalog(self, node):
-        if node.is_file:
-            return [node]
-        else:
-            x = [node]
-            for i in node.children:
-                x += self.update_catalog(i)
-            return x
+        # Delete from catalog and FAT table, the views follow the catalog
+        self.catalog.remove(node, self.fat, self.disk)
 
     def create_folder(self):
         """
@@ -626,26 +605,14 @@ class MainForm(QMainWindow):
         self.list_view.close_edit()
         
         # Check for duplicate names and generate unique name
-        folder_name = "New Folder"
-        count = 1
-        while any(node.name == folder_name for node in self.cur_node.children):
-            folder_name = f"New Folder ({count})"
-            count += 1
-            
-        # Create new item
-        self.item_1 = QListWidgetItem(QIcon("img/folder.png"), folder_name)
-        self.list_view.addItem(self.item_1)
+        folder_name = self.cur_node.unique_name("New Folder")
+
 
         # Add to directory tree
         new_node = CatalogNode(folder_name, False, self.fat, self.disk, time.localtime(time.time()), self.cur_node)
-        self.cur_node.children.append(new_node)
-        self.catalog.append(new_node)
-
-        # Update tree
-        self.update_tree()
+        self.catalog.add(self.cur_node, new_node)
         
         # Set focus and edit
-        self.list_view.setCurrentItem(self.item_1)
         self.list_view.setFocus()
         
         # 延迟一下激活编辑，确保UI已更新
@@ -659,26 +626,14 @@ class MainForm(QMainWindow):
         self.list_view.close_edit()
         
         # Check for duplicate names and generate unique name
-        file_name = "New File"
-        count = 1
-        while any(node.name == file_name for node in self.cur_node.children):
-            file_name = f"New File ({count})"
-            count += 1
-            
-        # Create new item
-        self.item_1 = QListWidgetItem(QIcon("img/file.png"), file_name)
-        self.list_view.addItem(self.item_1)
+        file_name = self.cur_node.unique_name("New File")
+
 
         # Add to directory tree
         new_node = CatalogNode(file_name, True, self.fat, self.disk, time.localtime(time.time()), self.cur_node)
-        self.cur_node.children.append(new_node)
-        self.catalog.append(new_node)
-
-        # Update tree
-        self.update_tree()
+        self.catalog.add(self.cur_node, new_node)
         
         # Set focus and edit
-        self.list_view.setCurrentItem(self.item_1)
         self.list_view.setFocus()
         
         # 延迟一下激活编辑，确保UI已更新
@@ -689,18 +644,18 @@ class MainForm(QMainWindow):
         View properties of the selected file or current folder
         """
         # View current directory properties if nothing selected
-        if len(self.list_view.selectedItems()) == 0:
+        if not self.list_view.selectedIndexes():
             self.child = AttributeForm(self.cur_node.name, False, self.cur_node.create_time, 
-                                      self.cur_node.update_time, len(self.cur_node.children))
+                                      self.cur_node.update_time, self.cur_node.child_count)
             self.child.show()
             return
         else:
             # Get the last selected item
-            node = self.cur_node.children[self.list_view.selectedIndexes()[-1].row()]
+            node = self.list_model.node(self.list_view.selectedIndexes()[-1])
             if node.is_file:
                 self.child = AttributeForm(node.name, node.is_file, node.create_time, node.update_time, 0)
             else:
-                self.child = AttributeForm(node.name, node.is_file, node.create_time, node.update_time, len(node.children))
+                self.child = AttributeForm(node.name, node.is_file, node.create_time, node.update_time, node.child_count)
             self.child.show()
             return
             
@@ -708,14 +663,13 @@ class MainForm(QMainWindow):
         """
         Write new data to file
         """
-        self.write_file.data.update(parameter, self.fat, self.disk)
-        self.write_file.update_time = time.localtime(time.time())
+        self.catalog.write(self.write_file, parameter, self.fat, self.disk)
 
     def show_menu(self, point):
         menu = QMenu(self.list_view)
         
         # If items are selected
-        if len(self.list_view.selectedItems()) != 0:
+        if self.list_view.selectedIndexes():
             """
             File operations for selected items
             """
@@ -802,131 +756,77 @@ class MainForm(QMainWindow):
             dest_point = self.list_view.mapToGlobal(point)
             menu.exec_(dest_point)
 
-    def update_tree(self):
+    def select_tree_node(self):
         """
-        Update the directory tree after changes
+        Select the current folder in the directory tree
         """
-        node = self.root_node
-        item = self.root_item
-
-        if item.childCount() < len(node.children):
-            # Add a new item
-            child = QTreeWidgetItem(item)
-        elif item.childCount() > len(node.children):
-            # Find and remove the corresponding element
-            for i in range(item.childCount()):
-                if i == item.childCount() - 1:
-                    item.removeChild(item.child(i))
-                    break
-                if item.child(i).text(0) != node.children[i].name:
-                    item.removeChild(item.child(i))
-                    break
-
-        for i in range(len(node.children)):
-            self.update_tree_recursive(node.children[i], item.child(i))
-
-        self.update_tree_recursive(node, item)
-
-    def update_tree_recursive(self, node: CatalogNode, item: QTreeWidgetItem):
+        self.tree.setCurrentIndex(self.tree_model.index_of(self.cur_node))
+
+    def load_cur_file(self):
         """
-        Recursively update tree items
+        Load files in the current directory
         """
-        item.setText(0, node.name)
-        if node.is_file:
-            item.setIcon(0, QIcon('img/file.png'))
-        else:
-            # Set icon based on whether it has children
-            if len(node.children) == 0:
-                item.setIcon(0, QIcon('img/folder.png'))
-            else:
-                item.setIcon(0, QIcon('img/folderWithFile.png'))
-            if item.childCount() < len(node.children):
-                # Add a new item
-                child = QTreeWidgetItem(item)
-            elif item.childCount() > len(node.children):
-                # Find and remove the corresponding element
-                for i in range(item.childCount()):
-                    if i == item.childCount() - 1:
-                        item.removeChild(item.child(i))
-                        break
-                    if item.child(i).text(0) != node.children[i].name:
-                        item.removeChild(item.child(i))
-                        break
-            for i in range(len(node.children)):
-                self.update_tree_recursive(node.children[i], item.child(i))
-
-
-    def build_tree(self):
+        self.list_model.set_directory(self.cur_node)
+
+    def collect_stats(self):
         """
-        Build the initial directory tree
+        Gather FAT, disk and catalog statistics
         """
-        self.tree.clear()
-        self.root_item = self.build_tree_recursive(self.catalog[0], self.tree)
-        # Add root node and its children
-        self.tree.addTopLevelItem(self.root_item)
-        self.tree.expandAll()
-        
-    def build_tree_recursive(self, node: CatalogNode, parent: QTreeWidgetItem):
+        return {
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'fat': self.fat.stats(),
+            # Blocks in error per kind of problem, all 0 on a healthy volume
+            'fat_check': {problem: len(blocks) for problem, blocks in self.fat.check().items()},
+            'disk': self.disk.stats(),
+            'catalog': {'loaded_nodes': len(self.catalog)},
+        }
+
+    def show_statistics(self):
         """
-        Build directory tree recursively
+        Show volume statistics
         """
-        child = QTreeWidgetItem(parent)
-        child.setText(0, node.name)
+        self.child = StatisticsForm(self.collect_stats)
+        self.child.show()
 
-        if node.is_file:
-            child.setIcon(0, QIcon('img/file.png'))
-        else:
-            if len(node.children) == 0:
-                child.setIcon(0, QIcon('img/folder.png'))
-            else:
-                child.setIcon(0, QIcon('img/folderWithFile.png'))
-            for i in node.children:
-                self.build_tree_recursive(i, child)
-        
-        return child
+    def defragment(self):
+        """
+        Start defragmenting the disk in the background
+        """
+        if self.defragmenter is not None:
+            return
+        self.list_view.close_edit()
+        self.defragmenter = Defragmenter(self.catalog, self.fat, self.disk)
+        self.defrag_timer.start(0)
 
-    def load_cur_file(self):
+    def defragment_step(self):
         """
-        Load files in the current directory
+        Run one bounded step of the defragmenter and report when it is done
         """
-        self.list_view.clear()
+        if not self.defragmenter.step():
+            self.statusBar().showMessage(f"Defragmenting... {self.defragmenter.progress:.0%}")
+            return
+        defragmenter = self.defragmenter
+        self.stop_defragment()
+        self.update_print()
 
-        for i in self.cur_node.children:
-            if i.is_file:
-                # Apply different icons based on filename extension
-                icon = self.get_file_icon(i.name)
-                self.item_1 = QListWidgetItem(icon, i.name)
-            else:
-                if len(i.children) == 0:
-                    self.item_1 = QListWidgetItem(QIcon("img/folder.png"), i.name)
-                else:
-                    self.item_1 = QListWidgetItem(QIcon("img/folderWithFile.png"), i.name)
-                    
-            # Add tooltips with file information
-            if i.is_file:
-                tooltip = f"File: {i.name}\nCreated: {time.strftime('%Y-%m-%d %H:%M:%S', i.create_time)}"
-            else:
-                item_count = len(i.children)
-                item_text = "items" if item_count != 1 else "item"
-                tooltip = f"Folder: {i.name}\nContains: {item_count} {item_text}\nCreated: {time.strftime('%Y-%m-%d %H:%M:%S', i.create_time)}"
-            
-            self.item_1.setToolTip(tooltip)
-            self.list_view.addItem(self.item_1)
-            
-    def get_file_icon(self, filename):
+        before, after = defragmenter.before, defragmenter.after
+        text = (f"Blocks moved: {defragmenter.moved}\n\n"
+                f"Fragmented files: {before['fragmented_files']} -> {after['fragmented_files']}\n"
+                f"Extents per file: {before['avg_extents_per_file']:.2f} -> {after['avg_extents_per_file']:.2f}\n"
+                f"Free space runs: {before['free_runs']} -> {after['free_runs']}\n"
+                f"Largest free run: {before['largest_free_run']} -> {after['largest_free_run']} blocks")
+        if defragmenter.incomplete:
+            text = 'The disk is full, defragmentation stopped early.\n\n' + text
+        QMessageBox.information(self, 'Defragment Disk', text)
+
+    def stop_defragment(self):
         """
-        Return appropriate icon based on file extension
+        Stop the defragmenter, leaving the blocks moved so far in place
         """
-        # Extract file extension (lowercase)
-        _, ext = os.path.splitext(filename.lower())
-        
-        # Default icon
-        icon = QIcon("img/file.png")
-        
-        # Add more icon mappings as needed
-        # This is just a placeholder - ideally you'd have more icons in your img folder
-        
-        return icon
+        self.defrag_timer.stop()
+        if self.defragmenter is not None:
+            self.defragmenter.close()
+            self.defragmenter = None
 
     def format(self):
         """
@@ -949,137 +849,55 @@ class MainForm(QMainWindow):
 
         if reply.clickedButton() == buttonN:
             return
+
+        # Choose where the new volume places file blocks
+        policies = list(ALLOCATORS)
+        policy, ok = QInputDialog.getItem(self, 'Format Disk', 'Block allocation policy:', policies,
+                                          policies.index(self.fat.policy), False)
+        if not ok:
+            return
+
+        # Choose the volume geometry
+        sizes = [str(1 << shift) for shift in range(9, 17)]
+        current = str(self.disk.block_size)
+        block_size, ok = QInputDialog.getItem(self, 'Format Disk', 'Block size (bytes):', sizes,
+                                              sizes.index(current) if current in sizes else 0, False)
+        if not ok:
+            return
+        block_num, ok = QInputDialog.getInt(self, 'Format Disk', 'Number of blocks:',
+                                            len(self.disk), 1, MAX_BLOCKS)
+        if not ok:
+            return
         
         """
         Format the file system
         """
-        self.fat = FAT()
-        self.fat.fat = [-2] * BLOCK_NUM
-        # Save FAT table
-        with open('fat', 'wb') as f:
-            f.write(pickle.dumps(self.fat))
-
-        self.disk = []
-        for i in range(BLOCK_NUM):
-            self.disk.append(Block(i))
-        # Save disk
-        with open('disk', 'wb') as f:
-            f.write(pickle.dumps(self.disk))
-        
-        self.catalog = []
-        self.catalog.append(CatalogNode("root", False, self.fat, self.disk, time.localtime(time.time())))
-        # Save catalog
-        with open('catalog', 'wb') as f:
-            f.write(pickle.dumps(self.catalog))
+        self.stop_defragment()
 
+        # The old volume is dropped, the new window opens the formatted one
+        self.volume.close()
         self.hide()
-        self.winform = MainForm()
+        self.winform = MainForm(Volume.format('.', policy, int(block_size), block_num))
         self.winform.show()
-        
-    
+
     def save_file(self):
         """
-        Save files from memory to disk
-        """
-        # Save FAT table
-        with open('fat', 'wb') as f:
-            f.write(pickle.dumps(self.fat))
-        # Save disk blocks
-        with open('disk', 'wb') as f:
-            f.write(pickle.dumps(self.disk))
-        # Save catalog
-        with open('catalog', 'wb') as f:
-            f.write(pickle.dumps(self.catalog))
-
-    def read_file(self):
-        """
-        Read file system data from disk
-        """
-        # Read FAT table
-        if not os.path.exists('fat'):
-            self.fat = FAT()
-            self.fat.fat = [-2] * BLOCK_NUM
-            # Store FAT table
-            with open('fat', 'wb') as f:
-                f.write(pickle.dumps(self.fat))
-        else:
-            with open('fat', 'rb') as f:
-                self.fat = pickle.load(f)
-
-        # Read disk blocks
-        if not os.path.exists('disk'):
-            self.disk = []
-            for i in range(BLOCK_NUM):
-                self.disk.append(Block(i))
-            # Store disk table
-            with open('disk', 'wb') as f:
-                f.write(pickle.dumps(self.disk))
-        else:
-            with open('disk', 'rb') as f:
-                self.disk = pickle.load(f)
-
-        # Read catalog
-        if not os.path.exists('catalog'):
-            self.catalog = []
-            self.catalog.append(CatalogNode("root", False, self.fat, self.disk, time.localtime(time.time())))
-            # Store
-            with open('catalog', 'wb') as f:
-                f.write(pickle.dumps(self.catalog))
-        else:
-            with open('catalog', 'rb') as f:
-                self.catalog = pickle.load(f)
-                
-            # Handle attribute name changes for backward compatibility
-            self.update_attributes_recursive(self.catalog[0])
-            
-    def update_attributes_recursive(self, node):
-        """
-        Update attribute names for backward compatibility
+        Save changes since the last save by appending them to the journal
         """
-        # Handle attribute name changes from 'isFile' to 'is_file'
-        if hasattr(node, 'isFile'):
-            node.is_file = node.isFile
-            
-        # Handle attribute name changes from 'createTime' to 'create_time'
-        if hasattr(node, 'createTime'):
-            node.create_time = node.createTime
-            
-        # Handle attribute name changes from 'updateTime' to 'update_time'
-        if hasattr(node, 'updateTime'):
-            node.update_time = node.updateTime
-            
-        # Recursively update children
-        if hasattr(node, 'is_file') and not node.is_file:
-            for child in node.children:
-                self.update_attributes_recursive(child)
+        self.volume.save()
 
-    def initial(self):
-        """
-        Initialize file system
-        """
-        # FAT table
-        self.fat = FAT()
-        self.fat.fat = [-2] * BLOCK_NUM
-        # Store FAT table
-        with open('fat', 'ab') as f:
-            f.write(pickle.dumps(self.fat))
-        
-        # Disk blocks
-        self.disk = []
-        for i in range(BLOCK_NUM):
-            self.disk.append(Block(i))
-        # Store disk table
-        with open('disk', 'ab') as f:
-            f.write(pickle.dumps(self.disk))
-        
-        # Catalog node
-        self.catalog = []
-        self.catalog.append(CatalogNode("root", False, self.fat, self.disk, time.localtime(time.time())))
-        # Store
-        with open('catalog', 'ab') as f:
-            f.write(pickle.dumps(self.catalog))
+    @property
+    def fat(self) -> FAT:
+        return self.volume.fat
+
+    @property
+    def disk(self) -> Disk:
+        return self.volume.disk
+
+    @property
+    def catalog(self) -> Catalog:
+        return self.volume.catalog
 
-    
     def back_event(self):
         """
         Navigate to parent directory
@@ -1091,18 +909,13 @@ class MainForm(QMainWindow):
             return False
 
         # Record last position for forward navigation
-        for i in range(len(self.cur_node.parent.children)):
-            if self.cur_node.parent.children[i].name == self.cur_node.name:
-                self.last_loc = i
-                self.forward_action.setEnabled(True)
-                break
+        self.last_name = self.cur_node.name
+        self.forward_action.setEnabled(True)
 
         self.cur_node = self.cur_node.parent
         self.update_loc()
         self.base_url.pop()
-        self.tree_item.pop()
-        self.tree.setCurrentItem(self.tree_item[-1])
-        self.update_tree()
+        self.select_tree_node()
         self.update_print()
 
         if self.cur_node == self.root_node:
@@ -1138,10 +951,14 @@ class MainForm(QMainWindow):
 
         reply.exec_()
 
+        if reply.clickedButton() != buttonN:
+            self.stop_defragment()
+
         if reply.clickedButton() == buttonI:
+            self.volume.close()
             event.accept()
         elif reply.clickedButton() == buttonY:
-            self.save_file()
+            self.volume.close(save=True)
             event.accept()
         else:
             event.ignore()
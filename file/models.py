@@ -0,0 +1,370 @@
+"""
+Qt item models over the catalog
+- CatalogTreeModel: Folder tree that fetches directory contents as they are expanded
+- CatalogListModel: Contents of one directory for the file list
+"""
+from itertools import islice
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from PyQt5.QtCore import QAbstractItemModel, QAbstractListModel, QModelIndex, Qt
+from PyQt5.QtGui import QIcon
+
+from File import Catalog, CatalogNode
+from events import ContentUpdated, NodeCreated, NodeDeleted, NodeMoved, NodeRenamed
+
+# Children added to the model per fetchMore call
+FETCH_BATCH = 256
+
+
+class CatalogTreeModel(QAbstractItemModel):
+    """
+    Tree model of a Catalog with the root directory as its only top-level row
+
+    Indexes carry node IDs. A directory has no rows until the view asks for
+    them through fetchMore, which reads its children from the catalog in
+    batches; the rows fetched so far are kept per directory so index() and
+    parent() do not build child lists. Catalog events are turned into
+    row insertions, removals and dataChanged signals for the affected rows
+    instead of resetting the model.
+    """
+    def __init__(self, catalog: Catalog, parent: Any = None):
+        super().__init__(parent)
+        self.catalog = catalog
+        # Fetched child IDs of each directory, and the row of each fetched node
+        self.rows: Dict[int, List[int]] = {}
+        self.row_of: Dict[int, int] = {catalog.root.id: 0}
+        self.icons = {
+            'file': QIcon('img/file.png'),
+            'folder': QIcon('img/folder.png'),
+            'folderWithFile': QIcon('img/folderWithFile.png'),
+        }
+        catalog.events.subscribe(self.on_created, NodeCreated)
+        catalog.events.subscribe(self.on_deleted, NodeDeleted)
+        catalog.events.subscribe(self.on_moved, NodeMoved)
+        catalog.events.subscribe(self.on_renamed, NodeRenamed)
+
+    def node(self, index: QModelIndex) -> Optional[CatalogNode]:
+        """
+        Return the node shown at index, or None for the invisible root
+        """
+        if not index.isValid():
+            return None
+        return self.catalog.get(index.internalId())
+
+    def index_of(self, node: CatalogNode) -> QModelIndex:
+        """
+        Return the index of node, fetching the folders on the way to it
+        """
+        if node.parent_id == -1:
+            return self.createIndex(0, 0, node.id)
+        parent = self.catalog.get(node.parent_id)
+        parent_index = self.index_of(parent)
+        while node.id not in self.row_of and self.canFetchMore(parent_index):
+            self.fetchMore(parent_index)
+        return self.createIndex(self.row_of[node.id], 0, node.id)
+
+    def index(self, row: int, column: int, parent: QModelIndex = QModelIndex()) -> QModelIndex:
+        if column != 0 or row < 0:
+            return QModelIndex()
+        if not parent.isValid():
+            return self.createIndex(0, 0, self.catalog.root.id) if row == 0 else QModelIndex()
+        rows = self.rows.get(parent.internalId())
+        if rows is None or row >= len(rows):
+            return QModelIndex()
+        return self.createIndex(row, 0, rows[row])
+
+    def parent(self, index: QModelIndex) -> QModelIndex:
+        node = self.node(index)
+        if node is None or node.parent_id == -1:
+            return QModelIndex()
+        return self.createIndex(self.row_of[node.parent_id], 0, node.parent_id)
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        if not parent.isValid():
+            return 1
+        return len(self.rows.get(parent.internalId(), ()))
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 1
+
+    def hasChildren(self, parent: QModelIndex = QModelIndex()) -> bool:
+        node = self.node(parent)
+        if node is None:
+            return True
+        # Answered from the stored child count, without loading the folder
+        return not node.is_file and node.child_count > 0
+
+    def canFetchMore(self, parent: QModelIndex) -> bool:
+        node = self.node(parent)
+        if node is None or node.is_file:
+            return False
+        return len(self.rows.get(node.id, ())) < node.child_count
+
+    def fetchMore(self, parent: QModelIndex) -> None:
+        node = self.node(parent)
+        if node is None or node.is_file:
+            return
+        rows = self.rows.setdefault(node.id, [])
+        # Rows are always a prefix of the folder's children
+        batch = list(islice(node.child_ids, len(rows), len(rows) + FETCH_BATCH))
+        if not batch:
+            return
+        self.beginInsertRows(parent, len(rows), len(rows) + len(batch) - 1)
+        for child_id in batch:
+            self.row_of[child_id] = len(rows)
+            rows.append(child_id)
+        self.endInsertRows()
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole) -> Any:
+        node = self.node(index)
+        if node is None:
+            return None
+        if role == Qt.DisplayRole:
+            return node.name
+        if role == Qt.DecorationRole:
+            if node.is_file:
+                return self.icons['file']
+            return self.icons['folder' if node.child_count == 0 else 'folderWithFile']
+        return None
+
+    def headerData(self, section: int, orientation: int, role: int = Qt.DisplayRole) -> Any:
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return 'Folders'
+        return None
+
+    def flags(self, index: QModelIndex) -> Qt.ItemFlags:
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    def _folder_changed(self, node_id: int) -> None:
+        # The folder icon depends on whether it is empty
+        row = self.row_of.get(node_id)
+        if row is not None:
+            index = self.createIndex(row, 0, node_id)
+            self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+    def _insert_row(self, node_id: int, parent_id: int) -> None:
+        parent = self.catalog.get(parent_id)
+        rows = self.rows.get(parent_id)
+        # Folders not fully fetched pick the node up in a later fetchMore
+        if rows is not None and parent_id in self.row_of and len(rows) == parent.child_count - 1:
+            parent_index = self.createIndex(self.row_of[parent_id], 0, parent_id)
+            self.beginInsertRows(parent_index, len(rows), len(rows))
+            self.row_of[node_id] = len(rows)
+            rows.append(node_id)
+            self.endInsertRows()
+        self._folder_changed(parent_id)
+
+    def _remove_row(self, node_id: int, parent_id: int) -> None:
+        row = self.row_of.get(node_id)
+        if row is not None:
+            parent_index = self.createIndex(self.row_of[parent_id], 0, parent_id)
+            rows = self.rows[parent_id]
+            self.beginRemoveRows(parent_index, row, row)
+            del rows[row]
+            for i in range(row, len(rows)):
+                self.row_of[rows[i]] = i
+            self.endRemoveRows()
+
+            # Forget the fetched rows of the subtree
+            stack = [node_id]
+            while stack:
+                current = stack.pop()
+                self.row_of.pop(current, None)
+                stack.extend(self.rows.pop(current, ()))
+        self._folder_changed(parent_id)
+
+    def on_created(self, event: NodeCreated) -> None:
+        self._insert_row(event.node_id, event.parent_id)
+
+    def on_deleted(self, event: NodeDeleted) -> None:
+        self._remove_row(event.node_id, event.parent_id)
+
+    def on_moved(self, event: NodeMoved) -> None:
+        self._remove_row(event.node_id, event.old_parent_id)
+        self._insert_row(event.node_id, event.new_parent_id)
+
+    def on_renamed(self, event: NodeRenamed) -> None:
+        row = self.row_of.get(event.node_id)
+        if row is not None:
+            index = self.createIndex(row, 0, event.node_id)
+            self.dataChanged.emit(index, index, [Qt.DisplayRole])
+
+
+class CatalogListModel(QAbstractListModel):
+    """
+    List model of the children of one directory
+
+    Rows hold node IDs only and are fetched in batches as the view scrolls.
+    Icons are shared by all rows and tooltips are formatted when the view
+    asks for them, so opening a large directory creates no per-item
+    objects. Editing a row renames the node through the catalog, and rows
+    follow the catalog events for the directory shown.
+    """
+    # Icon file for each file name extension; anything else uses file.png
+    FILE_ICONS: Dict[str, str] = {}
+
+    def __init__(self, catalog: Catalog, parent: Any = None):
+        super().__init__(parent)
+        self.catalog = catalog
+        self.directory: Optional[CatalogNode] = None
+        self.ids: List[int] = []
+        self.icons: Dict[str, QIcon] = {}
+        catalog.events.subscribe(self.on_created, NodeCreated)
+        catalog.events.subscribe(self.on_deleted, NodeDeleted)
+        catalog.events.subscribe(self.on_moved, NodeMoved)
+        catalog.events.subscribe(self.on_changed, NodeRenamed)
+        catalog.events.subscribe(self.on_changed, ContentUpdated)
+
+    def icon(self, path: str) -> QIcon:
+        icon = self.icons.get(path)
+        if icon is None:
+            icon = self.icons[path] = QIcon(path)
+        return icon
+
+    def node_icon(self, node: CatalogNode) -> QIcon:
+        """
+        Return the icon of node, based on the file name extension for files
+        """
+        if node.is_file:
+            _, ext = os.path.splitext(node.name.lower())
+            return self.icon(self.FILE_ICONS.get(ext, 'img/file.png'))
+        return self.icon('img/folder.png' if node.child_count == 0 else 'img/folderWithFile.png')
+
+    def set_directory(self, node: CatalogNode) -> None:
+        """
+        Show the contents of directory node
+        """
+        self.beginResetModel()
+        node.load()
+        self.directory = node
+        self.ids = []
+        self.endResetModel()
+        # The first screenful is there right away, the view fetches the rest
+        self.fetchMore(QModelIndex())
+
+    def node(self, index: QModelIndex) -> Optional[CatalogNode]:
+        """
+        Return the node shown at index, or None
+        """
+        if not index.isValid() or index.row() >= len(self.ids):
+            return None
+        return self.catalog.get(self.ids[index.row()])
+
+    def fetch_all(self) -> None:
+        """
+        Fetch the remaining rows of the directory
+        """
+        while self.canFetchMore(QModelIndex()):
+            self.fetchMore(QModelIndex())
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        if parent.isValid():
+            return 0
+        return len(self.ids)
+
+    def canFetchMore(self, parent: QModelIndex) -> bool:
+        if parent.isValid() or self.directory is None:
+            return False
+        return len(self.ids) < self.directory.child_count
+
+    def fetchMore(self, parent: QModelIndex) -> None:
+        if parent.isValid() or self.directory is None:
+            return
+        # Rows are always a prefix of the directory's children
+        batch = list(islice(self.directory.child_ids, len(self.ids), len(self.ids) + FETCH_BATCH))
+        if not batch:
+            return
+        self.beginInsertRows(QModelIndex(), len(self.ids), len(self.ids) + len(batch) - 1)
+        self.ids.extend(batch)
+        self.endInsertRows()
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole) -> Any:
+        node = self.node(index)
+        if node is None:
+            return None
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            return node.name
+        if role == Qt.DecorationRole:
+            return self.node_icon(node)
+        if role == Qt.ToolTipRole:
+            created = time.strftime('%Y-%m-%d %H:%M:%S', node.create_time)
+            if node.is_file:
+                return f"File: {node.name}\nCreated: {created}"
+            item_count = node.child_count
+            item_text = "items" if item_count != 1 else "item"
+            return f"Folder: {node.name}\nContains: {item_count} {item_text}\nCreated: {created}"
+        return None
+
+    def setData(self, index: QModelIndex, value: Any, role: int = Qt.EditRole) -> bool:
+        node = self.node(index)
+        if node is None or role != Qt.EditRole:
+            return False
+        new_name = str(value).strip()
+        # 如果名称为空，设置为默认名称
+        if not new_name:
+            new_name = "New File" if node.is_file else "New Folder"
+        if new_name == node.name:
+            return False
+        # 检查重名
+        new_name = self.directory.unique_name(new_name, exclude=node)
+        self.catalog.rename(node, new_name)
+        return True
+
+    def flags(self, index: QModelIndex) -> Qt.ItemFlags:
+        if not index.isValid():
+            return Qt.NoItemFlags
+        # The view only opens editors on request
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsEditable
+
+    def _insert_row(self, node_id: int, parent_id: int) -> None:
+        if self.directory is None or parent_id != self.directory.id:
+            return
+        # A directory not fully fetched picks the node up in a later fetchMore
+        if len(self.ids) == self.directory.child_count - 1:
+            self.beginInsertRows(QModelIndex(), len(self.ids), len(self.ids))
+            self.ids.append(node_id)
+            self.endInsertRows()
+
+    def _remove_row(self, node_id: int, parent_id: int) -> None:
+        if self.directory is None or parent_id != self.directory.id:
+            return
+        try:
+            row = self.ids.index(node_id)
+        except ValueError:
+            return
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.ids[row]
+        self.endRemoveRows()
+
+    def _row_changed(self, node_id: int) -> None:
+        node = self.catalog.get(node_id)
+        if self.directory is None or node is None or node.parent_id != self.directory.id:
+            return
+        try:
+            row = self.ids.index(node_id)
+        except ValueError:
+            return
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+    def on_created(self, event: NodeCreated) -> None:
+        self._insert_row(event.node_id, event.parent_id)
+        # The icon of a folder shown here depends on whether it is empty
+        self._row_changed(event.parent_id)
+
+    def on_deleted(self, event: NodeDeleted) -> None:
+        self._remove_row(event.node_id, event.parent_id)
+        self._row_changed(event.parent_id)
+
+    def on_moved(self, event: NodeMoved) -> None:
+        self._remove_row(event.node_id, event.old_parent_id)
+        self._insert_row(event.node_id, event.new_parent_id)
+        self._row_changed(event.old_parent_id)
+        self._row_changed(event.new_parent_id)
+
+    def on_changed(self, event: Any) -> None:
+        self._row_changed(event.node_id)
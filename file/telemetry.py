@@ -0,0 +1,86 @@
+"""
+Operation telemetry
+- LatencyStats: Call counts and latencies per operation
+- timed: Decorator recording the latency of a method
+- summarize: Latency figures of a list of samples
+"""
+import functools
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable
+
+# Latest samples kept per operation for percentiles
+SAMPLES = 1024
+
+
+def summarize(samples: Iterable[int]) -> Dict[str, float]:
+    """
+    Return count, mean, median, 99th percentile and maximum of latencies
+    given in nanoseconds, in microseconds
+    """
+    ordered = sorted(samples)
+    if not ordered:
+        return {'count': 0, 'mean_us': 0.0, 'p50_us': 0.0, 'p99_us': 0.0, 'max_us': 0.0}
+    return {
+        'count': len(ordered),
+        'mean_us': sum(ordered) / len(ordered) / 1000,
+        'p50_us': ordered[len(ordered) // 2] / 1000,
+        'p99_us': ordered[min(len(ordered) - 1, len(ordered) * 99 // 100)] / 1000,
+        'max_us': ordered[-1] / 1000,
+    }
+
+
+class LatencyStats:
+    """
+    Records how long each call of an operation took
+
+    Counts, totals and maxima cover every call; percentiles are taken over
+    the latest SAMPLES calls.
+    """
+    def __init__(self):
+        self.counts: Dict[str, int] = {}
+        self.totals: Dict[str, int] = {}
+        self.maxima: Dict[str, int] = {}
+        self.samples: Dict[str, Deque[int]] = {}
+
+    def record(self, op: str, elapsed: int) -> None:
+        """
+        Record a call of op that took elapsed nanoseconds
+        """
+        if op not in self.counts:
+            self.counts[op] = 0
+            self.totals[op] = 0
+            self.maxima[op] = 0
+            self.samples[op] = deque(maxlen=SAMPLES)
+        self.counts[op] += 1
+        self.totals[op] += elapsed
+        self.maxima[op] = max(self.maxima[op], elapsed)
+        self.samples[op].append(elapsed)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Return the latency figures of every operation
+        """
+        result = {}
+        for op, count in self.counts.items():
+            figures = summarize(self.samples[op])
+            figures.update(count=count, mean_us=self.totals[op] / count / 1000,
+                           max_us=self.maxima[op] / 1000)
+            result[op] = figures
+        return result
+
+
+def timed(op: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """
+    Record the latency of a method in the LatencyStats of its object's latency attribute
+    """
+    def decorate(method: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            start = time.perf_counter_ns()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.latency.record(op, time.perf_counter_ns() - start)
+        return wrapper
+    return decorate
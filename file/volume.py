@@ -0,0 +1,321 @@
+"""
+Headless access to a volume
+- Volume: FAT, disk image, catalog and journal of a volume, with path-based operations
+
+Nothing here depends on Qt, so scripts and the command-line tool can work
+on a volume without a display.
+"""
+import os
+import time
+from typing import Any, Dict, List, Tuple, Union
+
+from allocator import DEFAULT_POLICY
+from File import BLOCK_NUM, BLOCK_SIZE, Buffer, Catalog, CatalogNode, Disk, FAT
+from journal import Journal
+
+# Files of a volume, inside its directory
+FAT_FILE = 'fat'
+DISK_FILE = 'disk'
+CATALOG_FILE = 'catalog'
+JOURNAL_FILE = 'journal'
+
+
+class Volume:
+    """
+    A volume stored as the fat, disk, catalog and journal files of a directory
+
+    Opening applies the changes journaled after the last checkpoint. save()
+    appends the changes since the previous save to the journal and copies
+    them into the main files once the journal is large; close() releases
+    the files, saving first if asked to.
+
+    Paths are '/'-separated names; absolute paths start at the root and
+    relative ones at cwd, and '.' and '..' are understood. They are turned
+    into keys and resolved through the catalog's dentry cache.
+
+    Missing volume files are created, as a new volume, unless create is
+    False, in which case opening a directory without a volume fails.
+    """
+    def __init__(self, directory: str = '.', create: bool = True):
+        self.directory = directory
+        if not create:
+            for name in (FAT_FILE, DISK_FILE):
+                if not os.path.exists(self._file(name)):
+                    raise FileNotFoundError(f"No volume in {directory}: {name} is missing")
+        self.load()
+        self.cwd = self.catalog.root
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def load(self) -> None:
+        """
+        Read the volume, converting files written by older versions
+        """
+        # Read FAT table, a new or pickled table is stored in the current format
+        self.fat = FAT.load(self._file(FAT_FILE))
+        if self.fat.all_dirty:
+            self.fat.save(self._file(FAT_FILE))
+
+        # Open disk image
+        disk_path = self._file(DISK_FILE)
+        if Disk.is_legacy(disk_path):
+            # Convert a pickled list of blocks, which may extend some FAT chains
+            self.disk = Disk.convert_legacy(disk_path, self.fat)
+            self.fat.save(self._file(FAT_FILE))
+        else:
+            self.disk = Disk.open(disk_path)
+        if self.fat.block_num != len(self.disk):
+            self.disk.close()
+            raise ValueError("The FAT and the disk image do not belong to the same volume")
+
+        # Read catalog
+        if not os.path.exists(self._file(CATALOG_FILE)):
+            self.catalog = Catalog(CatalogNode("root", False, self.fat, self.disk, time.localtime()))
+            self.save_catalog()
+        else:
+            # A pickled catalog is stored in the current format
+            self.catalog = Catalog.load(self._file(CATALOG_FILE))
+            if self.catalog.all_dirty:
+                self.save_catalog()
+        self.catalog_pending = False
+
+        # Apply changes saved to the journal after the last checkpoint
+        self.journal = Journal(self._file(JOURNAL_FILE))
+        applied, self.catalog_pending = self.journal.replay(self.fat, self.disk, self.catalog)
+        if applied:
+            self.checkpoint()
+
+    @classmethod
+    def format(cls, directory: str = '.', policy: str = DEFAULT_POLICY,
+               block_size: int = BLOCK_SIZE, block_num: int = BLOCK_NUM) -> 'Volume':
+        """
+        Create an empty volume in directory, replacing any volume there, and open it
+        """
+        fat = FAT(policy, block_num)
+        fat.save(os.path.join(directory, FAT_FILE))
+        disk = Disk.create(os.path.join(directory, DISK_FILE), block_size, block_num)
+        Catalog(CatalogNode("root", False, fat, disk, time.localtime())).save(
+            os.path.join(directory, CATALOG_FILE))
+        disk.close()
+        # Drop journaled changes of the old volume
+        journal = Journal(os.path.join(directory, JOURNAL_FILE))
+        journal.reset()
+        journal.close()
+        return cls(directory)
+
+    def save(self) -> None:
+        """
+        Save changes since the last save by appending them to the journal
+        """
+        if self.catalog.changed or self.catalog.removed:
+            self.catalog_pending = True
+        self.journal.commit(self.fat, self.disk, self.catalog)
+
+        if self.journal.needs_checkpoint():
+            self.checkpoint()
+
+    def checkpoint(self) -> None:
+        """
+        Copy the journaled changes into the FAT, disk and catalog files and empty the journal
+
+        Every file is synced before the journal is emptied, so a crash on the
+        way leaves the journal to replay over the main files again.
+        """
+        self.journal.sync()
+        # Save changed FAT entries
+        self.fat.save(self._file(FAT_FILE))
+        # Save modified disk blocks
+        self.disk.save()
+        # Save catalog if it changed
+        if self.catalog_pending:
+            self.save_catalog()
+        self.journal.reset()
+
+    def save_catalog(self) -> None:
+        """
+        Write the whole catalog and mark its nodes as saved
+        """
+        self.catalog.save(self._file(CATALOG_FILE))
+        self.catalog_pending = False
+
+    def close(self, save: bool = False) -> None:
+        """
+        Release the volume files, saving and checkpointing first if save is set
+        """
+        if save:
+            self.save()
+            self.checkpoint()
+        self.journal.close()
+        self.disk.close()
+
+    def __enter__(self) -> 'Volume':
+        return self
+
+    def __exit__(self, exc_type, *args) -> None:
+        self.close(save=exc_type is None)
+
+    def _key(self, path: str) -> Tuple[str, ...]:
+        # Names from the root down to path
+        key = [] if path.startswith('/') else list(self.catalog.key_of(self.cwd))
+        for name in path.split('/'):
+            if name in ('', '.'):
+                continue
+            if name == '..':
+                if key:
+                    key.pop()
+                continue
+            key.append(name)
+        return tuple(key)
+
+    def resolve(self, path: str) -> CatalogNode:
+        """
+        Return the node at path
+        """
+        node = self.catalog.resolve(self._key(path))
+        if node is None:
+            raise FileNotFoundError(f"No such file or directory: {path}")
+        return node
+
+    def _directory(self, path: str) -> CatalogNode:
+        node = self.resolve(path)
+        if node.is_file:
+            raise NotADirectoryError(f"Not a directory: {path}")
+        return node
+
+    def _split(self, path: str) -> Tuple[CatalogNode, str]:
+        # Parent directory and name of a path that may not exist yet
+        head, _, name = path.rstrip('/').rpartition('/')
+        if name in ('', '.', '..'):
+            raise ValueError(f"Invalid name: {path}")
+        return self._directory(head or ('/' if path.startswith('/') else '.')), name
+
+    def path_of(self, node: CatalogNode) -> str:
+        return self.catalog.path_of(node)
+
+    def cd(self, path: str) -> None:
+        """
+        Change the directory relative paths start from
+        """
+        self.cwd = self._directory(path)
+
+    def listdir(self, path: str = '.') -> List[CatalogNode]:
+        """
+        Return the entries of the directory at path
+        """
+        return self._directory(path).children
+
+    def read(self, path: str) -> bytes:
+        """
+        Return the content of the file at path
+        """
+        node = self.resolve(path)
+        if not node.is_file:
+            raise IsADirectoryError(f"Is a directory: {path}")
+        return node.data.read_bytes(self.fat, self.disk)
+
+    def write(self, path: str, data: Union[str, Buffer]) -> CatalogNode:
+        """
+        Replace the content of the file at path, creating it if missing
+        """
+        parent, name = self._split(path)
+        node = parent.get_child(name)
+        if node is None:
+            node = CatalogNode(name, True, self.fat, self.disk, time.localtime(), parent, data)
+            self.catalog.add(parent, node)
+        elif not node.is_file:
+            raise IsADirectoryError(f"Is a directory: {path}")
+        else:
+            self.catalog.write(node, data, self.fat, self.disk)
+        return node
+
+    def mkdir(self, path: str, parents: bool = False) -> CatalogNode:
+        """
+        Create the directory at path, and missing parents if parents is set
+        """
+        if parents:
+            key = self._key(path)
+            node = self.catalog.root
+            for depth in range(1, len(key) + 1):
+                child = self.catalog.resolve(key[:depth])
+                if child is None:
+                    child = CatalogNode(key[depth - 1], False, self.fat, self.disk, time.localtime(), node)
+                    self.catalog.add(node, child)
+                elif child.is_file:
+                    raise NotADirectoryError(f"Not a directory: {'/' + '/'.join(key[:depth])}")
+                node = child
+            return node
+        parent, name = self._split(path)
+        if parent.get_child(name) is not None:
+            raise FileExistsError(f"File exists: {path}")
+        node = CatalogNode(name, False, self.fat, self.disk, time.localtime(), parent)
+        self.catalog.add(parent, node)
+        return node
+
+    def remove(self, path: str, recursive: bool = False) -> None:
+        """
+        Remove the file or directory at path; a directory that is not empty
+        only if recursive is set
+        """
+        node = self.resolve(path)
+        if node.parent is None:
+            raise PermissionError("The root directory cannot be removed")
+        if not node.is_file and node.child_count and not recursive:
+            raise OSError(f"Directory not empty: {path}")
+        self.catalog.remove(node, self.fat, self.disk)
+
+    def rename(self, path: str, name: str) -> None:
+        """
+        Give the node at path a new name in the same directory
+        """
+        node = self.resolve(path)
+        if node.parent.get_child(name) is not None:
+            raise FileExistsError(f"File exists: {name}")
+        self.catalog.rename(node, name)
+
+    def move(self, path: str, directory: str) -> None:
+        """
+        Move the node at path into another directory
+        """
+        self.catalog.move(self.resolve(path), self._directory(directory))
+
+    def stat(self, path: str) -> Dict[str, Any]:
+        """
+        Describe the node at path
+        """
+        node = self.resolve(path)
+        info = {
+            'path': self.path_of(node),
+            'type': 'file' if node.is_file else 'directory',
+            'created': time.strftime('%Y-%m-%d %H:%M:%S', node.create_time),
+            'modified': time.strftime('%Y-%m-%d %H:%M:%S', node.update_time),
+        }
+        if node.is_file:
+            fcb = node.data
+            extents = fcb.get_extents(self.fat) if fcb.start != -1 else []
+            info.update({
+                'size': fcb.size(self.fat, self.disk),
+                'blocks': sum(length for _, length in extents),
+                'start': fcb.start,
+                'extents': len(extents),
+            })
+        else:
+            info['entries'] = node.child_count
+        return info
+
+    def df(self) -> Dict[str, Any]:
+        """
+        Report the size and free space of the volume
+        """
+        block_size = self.disk.block_size
+        used = self.fat.block_num - self.fat.free_count
+        return {
+            'block_size': block_size,
+            'total_blocks': self.fat.block_num,
+            'used_blocks': used,
+            'free_blocks': self.fat.free_count,
+            'total_bytes': self.fat.block_num * block_size,
+            'used_bytes': used * block_size,
+            'free_bytes': self.fat.free_count * block_size,
+            'policy': self.fat.policy,
+        }